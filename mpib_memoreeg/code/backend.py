@@ -0,0 +1,303 @@
+"""
+Following code publishes the converted dataset to its output location while the conversion is still running: every
+subject is uploaded as soon as it is published in BIDS_ROOT, dataset-level files once they are written. Files whose
+checksum already matches the uploaded copy are skipped, so an upload can be repeated or resumed at any time.
+
+Output locations (backends):
+- a folder, e.g. a mounted network share: /mnt/share/mpib_memoreeg
+- an S3-compatible object store: s3://bucket/prefix. Needs boto3. Large files are uploaded in parallel parts.
+  A different endpoint (e.g. a local stand-in server such as MinIO) is set with the S3_ENDPOINT_URL environment
+  variable, credentials are taken from the usual AWS environment variables or configuration files.
+
+MNE-BIDS writes to a file system, so the conversion itself always writes into BIDS_ROOT first.
+
+An output location can be tried with a small temporary dataset first: python backend.py check s3://bucket/prefix
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import argparse
+import os
+import os.path as op
+import shutil
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import manifest
+
+# boto3 is optional, it is only needed for uploads into an object store
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+# Endpoint of the S3-compatible object store. None for AWS S3.
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+# Number of files uploaded at the same time
+UPLOAD_JOBS = 8
+# Files larger than this are uploaded in parts of this size, PART_JOBS parts of a file at the same time (bytes)
+PART_SIZE = 64 * 1024 * 1024
+PART_JOBS = 4
+# Part size used by the backend check, small so that the check file is uploaded in several parts (bytes)
+CHECK_PART_SIZE = 5 * 1024 * 1024
+
+
+class LocalBackend:
+    """
+    Class represents an output folder, e.g. on a mounted network share.
+    """
+
+    def __init__(self, root):
+        """
+        Construct LocalBackend class instance
+        :param str root: Output folder
+        """
+        self.root = root
+
+    def digest(self, key):
+        """
+        :param str key: Path relative to the output location, with forward slashes
+        :return str: SHA-256 of the stored file, None if it does not exist
+        """
+        path = op.join(self.root, key)
+        return manifest.sha256(path) if op.isfile(path) else None
+
+    def put(self, path, key, digest):
+        """
+        Store a file. It is written under a temporary name and renamed, readers never see half of it.
+        :param str path: Local file
+        :param str key: Path relative to the output location, with forward slashes
+        :param str digest: SHA-256 of the file
+        """
+        target = op.join(self.root, key)
+        os.makedirs(op.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target + ".tmp")
+        os.replace(target + ".tmp", target)
+
+    def keys(self, prefix):
+        """
+        :param str prefix: Folder relative to the output location, e.g. sub-01
+        :return list: Keys of all stored files in the folder
+        """
+        keys = []
+        for folder, _, names in os.walk(op.join(self.root, prefix)):
+            keys += [op.relpath(op.join(folder, name), self.root).replace(os.sep, "/") for name in names]
+        return keys
+
+    def delete(self, key):
+        os.remove(op.join(self.root, key))
+
+
+class S3Backend:
+    """
+    Class represents a bucket (and a prefix in it) of an S3-compatible object store. Checksums of uploaded files are
+    kept in the object metadata, ETags of multipart uploads are no checksums of the content.
+    """
+
+    def __init__(self, bucket, prefix="", endpoint_url=S3_ENDPOINT_URL, part_size=PART_SIZE):
+        """
+        Construct S3Backend class instance
+        :param str bucket: Name of the bucket
+        :param str prefix: Prefix of all keys, e.g. datasets/mpib_memoreeg
+        :param str endpoint_url: Endpoint of the object store, None for AWS S3
+        :param int part_size: Files larger than this are uploaded in parts of this size (bytes)
+        """
+        if boto3 is None:
+            raise ImportError("Uploading into an object store needs boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.config = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size,
+                                     max_concurrency=PART_JOBS)
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def digest(self, key):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return head.get("Metadata", {}).get("sha256")
+
+    def put(self, path, key, digest):
+        self.client.upload_file(path, self.bucket, self._key(key), ExtraArgs={"Metadata": {"sha256": digest}},
+                                Config=self.config)
+
+    def keys(self, prefix):
+        keys = []
+        start = len(self._key(""))
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket,
+                                                                          Prefix=self._key(prefix) + "/"):
+            keys += [item["Key"][start:] for item in page.get("Contents", [])]
+        return keys
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+def open_backend(url, part_size=PART_SIZE):
+    """
+    Choose a backend for an output location
+    :param str url: s3://bucket/prefix or a folder
+    :param int part_size: Files larger than this are uploaded into an object store in parts of this size (bytes)
+    :return: LocalBackend or S3Backend class instance
+    """
+    if url.startswith("s3://"):
+        bucket, _, prefix = url[len("s3://"):].partition("/")
+        return S3Backend(bucket, prefix, part_size=part_size)
+    return LocalBackend(url)
+
+
+class Uploader:
+    """
+    Class keeps an output location in sync with (parts of) BIDS_ROOT. Checksums of local files are remembered by size
+    and modification time, so files are hashed only once even if they are synced several times during a run.
+    """
+
+    def __init__(self, backend, bids_root, jobs=UPLOAD_JOBS):
+        """
+        Construct Uploader class instance
+        :param backend: LocalBackend or S3Backend class instance
+        :param str bids_root: Location of the dataset
+        :param int jobs: Number of files uploaded at the same time
+        """
+        self.backend = backend
+        self.bids_root = bids_root
+        self.jobs = jobs
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def _digest(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if key in self._digests:
+                return self._digests[key]
+        digest = manifest.sha256(path)
+        with self._lock:
+            self._digests[key] = digest
+        return digest
+
+    def upload(self, key):
+        """
+        Upload a single file unless the stored copy has the same checksum
+        :param str key: Path relative to BIDS_ROOT, with forward slashes
+        :return bool: True if the file has been uploaded. False if it is unchanged or has been removed meanwhile (e.g. a
+        subject sidecar deduplicated during the upload, see inheritance.py), a later sync deletes a stored copy then
+        """
+        path = op.join(self.bids_root, key)
+        try:
+            digest = self._digest(path)
+            if self.backend.digest(key) == digest:
+                return False
+            self.backend.put(path, key, digest)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def sync(self, prefixes=None, clean=None):
+        """
+        Upload changed files in parallel and delete stored files which do not exist locally anymore
+        :param list prefixes: Folders to sync, e.g. sub-01. None for all output files (see manifest.output_files())
+        :param list clean: Folders in which stored files without a local counterpart are deleted. Default: prefixes
+        :return tuple: Numbers of uploaded, skipped and deleted files
+        """
+        keys = manifest.output_files(self.bids_root)
+        if prefixes is not None:
+            keys = [key for key in keys if key.split("/")[0] in prefixes]
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            uploaded = sum(pool.map(self.upload, keys))
+
+        deleted = 0
+        for prefix in (prefixes if clean is None else clean) or []:
+            for key in set(self.backend.keys(prefix)) - set(keys):
+                self.backend.delete(key)
+                deleted += 1
+        return uploaded, len(keys) - uploaded, deleted
+
+
+def check(url):
+    """
+    Sync a small temporary dataset to an output location several times and compare the result with what is expected:
+    a first upload, a repeated one which skips everything, then one with a changed and a removed file. Meant to try a
+    backend (e.g. a stand-in server such as MinIO or moto for S3Backend) before uploading the real dataset.
+    :param str url: s3://bucket/prefix or a folder. The bucket has to exist, the files of the check are deleted again
+    :return list: Problems found, empty if the backend works as expected
+    """
+    backend = open_backend(url, CHECK_PART_SIZE)
+    problems = []
+    with tempfile.TemporaryDirectory() as bids_root:
+        files = {"dataset_description.json": b"{}",
+                 "sub-01/eeg/sub-01_task-check_eeg.eeg": os.urandom(2 * CHECK_PART_SIZE + 1),
+                 "sub-01/eeg/sub-01_task-check_eeg.json": b"{}",
+                 "sub-02/beh/sub-02_task-check_beh.tsv": b"trial\n1\n"}
+        for key, content in files.items():
+            os.makedirs(op.dirname(op.join(bids_root, key)), exist_ok=True)
+            with open(op.join(bids_root, key), "wb") as file:
+                file.write(content)
+        subs = ["sub-01", "sub-02"]
+
+        def expect(step, result, counts):
+            if result != counts:
+                problems.append(f"{step}: {result} uploaded, skipped and deleted files instead of {counts}")
+
+        expect("first upload", Uploader(backend, bids_root).sync(), (len(files), 0, 0))
+        for key in files:
+            if backend.digest(key) != manifest.sha256(op.join(bids_root, key)):
+                problems.append(f"first upload: {key} has a wrong checksum in the output location")
+        expect("repeated upload", Uploader(backend, bids_root).sync(None, subs), (0, len(files), 0))
+
+        # Change a file of one subject, remove the only file of the other one
+        with open(op.join(bids_root, "sub-01/eeg/sub-01_task-check_eeg.json"), "wb") as file:
+            file.write(b'{"changed": true}')
+        os.remove(op.join(bids_root, "sub-02/beh/sub-02_task-check_beh.tsv"))
+        expect("changed upload", Uploader(backend, bids_root).sync(None, subs), (1, len(files) - 2, 1))
+        if backend.keys("sub-02"):
+            problems.append("changed upload: removed file is still in the output location")
+        if sorted(backend.keys("sub-01")) != sorted(key for key in files if key.startswith("sub-01/")):
+            problems.append(f"changed upload: unexpected files {backend.keys('sub-01')} in the output location")
+
+    # Clean up the output location
+    for key in backend.keys("sub-01") + backend.keys("sub-02") + ["dataset_description.json"]:
+        backend.delete(key)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Output locations of the MemorEEG BIDS dataset.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    target = commands.add_parser('check', help='Upload a small temporary dataset and check the result.')
+    target.add_argument('url', help='s3://bucket/prefix or a folder. S3_ENDPOINT_URL sets another endpoint.')
+    args = parser.parse_args()
+
+    problems = check(args.url)
+    for problem in problems:
+        print(problem)
+    print(f'{args.url}: ' + ('works as expected' if not problems else f'{len(problems)} problems'))
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
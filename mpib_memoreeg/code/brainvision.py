@@ -0,0 +1,160 @@
+"""
+Following code reads BrainVision header (.vhdr) and marker (.vmrk) files directly, without loading the recording
+with MNE. It is used wherever only markers or recording parameters are needed, e.g. for quality control.
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os.path as op
+import numpy as np
+
+
+def _read(path):
+    """
+    Helper function to read a file from disk
+    :param str path: Path of the file
+    :return bytes: Contents
+    """
+    with open(path, "rb") as binary:
+        return binary.read()
+
+
+def _sections(path, read=_read):
+    """
+    Helper function to split a BrainVision text file into [Sections] with key=value entries
+    :param str path: Path of the .vhdr or .vmrk file
+    :param callable read: Function reading a file as bytes, e.g. sources.Source.read to read from archives
+    :return dict: Section names mapped to lists of (key, value) pairs, in file order
+    """
+    sections = {}
+    current = None
+    # Newer BrainVision Recorder versions write UTF-8, older ones the Windows code page
+    data = read(path)
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        text = data.decode("cp1252")
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(";"):
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            current = sections.setdefault(line[1:-1], [])
+        elif current is not None and "=" in line:
+            key, value = line.split("=", 1)
+            current.append((key, value))
+    return sections
+
+
+def read_header(vhdr_path, read=_read):
+    """
+    Read recording parameters from a BrainVision header file
+    :param str vhdr_path: Path of the .vhdr file
+    :param callable read: Function reading a file as bytes, see _sections()
+    :return dict: Recording parameters: data_file and marker_file (full paths), n_channels, sfreq (Hz),
+    binary_format (e.g. INT_16), orientation (MULTIPLEXED or VECTORIZED) and channels (list of (name, resolution,
+    unit))
+    """
+    sections = _sections(vhdr_path, read)
+    common = dict(sections.get("Common Infos", []))
+    binary = dict(sections.get("Binary Infos", []))
+    folder = op.dirname(vhdr_path)
+
+    channels = []
+    for _, value in sections.get("Channel Infos", []):
+        # Format: <name>,<reference>,<resolution>,<unit>. Commas in names are escaped as \1
+        fields = value.split(",")
+        name = fields[0].replace(r"\1", ",")
+        resolution = float(fields[2]) if len(fields) > 2 and fields[2] else 1.0
+        unit = fields[3] if len(fields) > 3 else "µV"
+        channels.append((name, resolution, unit))
+
+    return {
+        "data_file": op.join(folder, common["DataFile"]),
+        "marker_file": op.join(folder, common["MarkerFile"]),
+        "n_channels": int(common["NumberOfChannels"]),
+        # Sampling interval is given in microseconds
+        "sfreq": 1e6 / float(common["SamplingInterval"]),
+        "binary_format": binary.get("BinaryFormat", "INT_16"),
+        "orientation": common.get("DataOrientation", "MULTIPLEXED"),
+        "channels": channels,
+    }
+
+
+def read_markers(vmrk_path, read=_read):
+    """
+    Read all markers from a BrainVision marker file
+    :param str vmrk_path: Path of the .vmrk file
+    :param callable read: Function reading a file as bytes, see _sections()
+    :return list: Markers as (type, description, sample, length) tuples. Samples count from 0 (BrainVision
+    counts from 1), e.g. ('Stimulus', 'S 12', 10342, 1) or ('New Segment', '', 0, 1)
+    """
+    markers = []
+    for _, value in _sections(vmrk_path, read).get("Marker Infos", []):
+        # Format: <type>,<description>,<position>,<size>,<channel>[,<date>]
+        fields = value.split(",")
+        markers.append((fields[0], fields[1].replace(r"\1", ","), int(fields[2]) - 1, int(fields[3])))
+    return markers
+
+
+def stimulus_markers(vmrk_path, read=_read):
+    """
+    Read stimulus (trigger) markers as arrays
+    :param str vmrk_path: Path of the .vmrk file
+    :param callable read: Function reading a file as bytes, see _sections()
+    :return tuple: (samples, codes) as NumPy arrays, e.g. code 12 for marker 'S 12'
+    """
+    stimuli = [(sample, int(description[1:])) for kind, description, sample, _ in read_markers(vmrk_path, read)
+               if kind == "Stimulus" and description[1:].strip().isdigit()]
+    if not stimuli:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int16)
+    samples, codes = zip(*stimuli)
+    return np.array(samples, dtype=np.int64), np.array(codes, dtype=np.int16)
+
+
+# Sample formats of BrainVision binary files and their NumPy equivalents (little endian)
+DTYPES = {
+    "INT_16": np.dtype("<i2"),
+    "INT_32": np.dtype("<i4"),
+    "IEEE_FLOAT_32": np.dtype("<f4"),
+}
+
+
+def n_samples(header, data_size):
+    """
+    Helper function to determine length of a recording from the size of its binary file
+    :param dict header: Recording parameters, see read_header()
+    :param int data_size: Size of the binary file in bytes
+    :return int: Number of samples
+    """
+    return data_size // (DTYPES[header["binary_format"]].itemsize * header["n_channels"])
+
+
+def memmap(header):
+    """
+    Map the binary data of a recording into memory without reading it. Only parts which are used are read from disk
+    :param dict header: Recording parameters, see read_header()
+    :return np.memmap: Data in raw units (multiply by channel resolution for µV), shape (samples, channels)
+    """
+    dtype = DTYPES[header["binary_format"]]
+    n_channels = header["n_channels"]
+    length = n_samples(header, op.getsize(header["data_file"]))
+    if header["orientation"] == "VECTORIZED":
+        return np.memmap(header["data_file"], dtype=dtype, mode="r", shape=(n_channels, length)).T
+    return np.memmap(header["data_file"], dtype=dtype, mode="r", shape=(length, n_channels))
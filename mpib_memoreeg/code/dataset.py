@@ -0,0 +1,247 @@
+"""
+Following code gives analysis code access to the converted dataset without building paths by hand:
+
+import dataset
+data = dataset.MemorEEGDataset()
+events = data.events(1)               # typed *_events.tsv of sub-01
+beh = data.beh(1)                     # typed *_beh.tsv of sub-01
+raw = data.raw(1)                     # MNE Raw of sub-01, data is read only when used
+tables = data.load([1, 2, 3])         # events and behavioral tables of several subjects, read in parallel
+events = data.events(33, run=1)       # first run of a subject split into runs (source2bids.py --runs)
+
+Subjects are taken from participants.tsv. Parsed tables are kept in a size-bounded LRU cache keyed on fingerprints of
+the files, so repeated access is a memory read, and a file written anew (e.g. by a new conversion) is parsed again.
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import glob
+import os.path as op
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from mne_bids import BIDSPath, read_raw_bids, get_entities_from_fname
+import subject as s
+import derivatives as d
+
+# Default BIDS path.
+BIDS_ROOT = op.join(op.dirname(op.realpath(__file__)), "..")
+# Upper limit for memory used by cached tables (bytes)
+CACHE_BYTES = 512 * 1024 * 1024
+# Number of files parsed at the same time by MemorEEGDataset.load()
+READERS = 8
+# Datatype folders and suffixes of the tables MemorEEGDataset.load() reads
+TABLES = {"events": ("eeg", "events"), "beh": ("beh", "beh")}
+
+# Column types of *_events.tsv (see Subject.events_to_bids()); behavioral columns are inferred
+EVENTS_DTYPES = {
+    "onset": "float64",
+    "duration": "float64",
+    "trial": "Int64",
+    "sample": "Int64",
+    "stim_file": pd.CategoricalDtype(s.STIM_FILES),
+    "event": pd.CategoricalDtype(s.EVENT_TYPES),
+    "rotation": "float32",
+    "position": "float32",
+}
+
+
+class LRUCache:
+    """
+    Class keeps parsed tables in memory, up to a total size. The least recently used tables are dropped first.
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        """
+        Construct LRUCache class instance
+        :param int max_bytes: Upper limit for memory used by cached tables
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up a table and mark it as recently used
+        :param tuple key: Cache key
+        :return pd.DataFrame: Cached table, None if it is not cached
+        """
+        with self._lock:
+            if key not in self._tables:
+                return None
+            self._tables.move_to_end(key)
+            return self._tables[key][0]
+
+    def put(self, key, table):
+        """
+        Cache a table, dropping least recently used tables until it fits
+        :param tuple key: Cache key
+        :param pd.DataFrame table: Table to cache. Tables larger than the whole cache are not cached
+        """
+        size = int(table.memory_usage(deep=True).sum())
+        with self._lock:
+            if key in self._tables:
+                self.bytes -= self._tables.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            while self.bytes + size > self.max_bytes:
+                self.bytes -= self._tables.popitem(last=False)[1][1]
+            self._tables[key] = (table, size)
+            self.bytes += size
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self.bytes = 0
+
+
+def _subject(row):
+    """
+    Helper function to create a Subject class instance out of a participants.tsv row
+    :param pd.Series row: Row of participants.tsv, all values as strings
+    :return s.Subject: Subject class instance without source data
+    """
+    def number(value):
+        return None if value in ("", "n/a") else int(float(value))
+
+    return s.Subject(int(row.participant_id[len("sub-"):]), number(row.age), row.sex, row.hand,
+                     number(row.stimuli_set), number(row.distractor_set), data_path=None)
+
+
+class MemorEEGDataset:
+    """
+    Class gives lazy, cached access to the converted data of all subjects listed in participants.tsv.
+    """
+
+    def __init__(self, bids_root=BIDS_ROOT, cache_bytes=CACHE_BYTES):
+        """
+        Construct MemorEEGDataset class instance. Only participants.tsv is read.
+        :param str bids_root: Location of the dataset
+        :param int cache_bytes: Upper limit for memory used by cached tables
+        """
+        self.bids_root = bids_root
+        self.cache = LRUCache(cache_bytes)
+        participants = pd.read_csv(op.join(bids_root, "participants.tsv"), sep="\t", dtype=str,
+                                   keep_default_na=False)
+        self.participants = participants
+        self.subjects = {int(row.participant_id[len("sub-"):]): _subject(row) for row in participants.itertuples()}
+
+    def __len__(self):
+        return len(self.subjects)
+
+    def __iter__(self):
+        return iter(self.subjects.values())
+
+    def __getitem__(self, sub_id):
+        """
+        :param int sub_id: Numerical subject ID
+        :return s.Subject: Subject class instance
+        """
+        return self.subjects[sub_id]
+
+    def path(self, sub_id, datatype, suffix, extension=".tsv", run=None):
+        """
+        Helper function to determine location of a file of a subject
+        :param int sub_id: Numerical subject ID
+        :param str datatype: BIDS datatype folder, e.g. eeg
+        :param str suffix: BIDS suffix, e.g. events
+        :param str extension: File extension
+        :param int run: Run number if the data has been split into runs (source2bids.py --runs), None otherwise
+        :return BIDSPath: Path of the file
+        """
+        participant = self.subjects[sub_id]
+        return BIDSPath(subject=participant.id, task=participant.task, run=run, root=self.bids_root, datatype=datatype,
+                        suffix=suffix, extension=extension)
+
+    def runs(self, sub_id, datatype, suffix, extension=".tsv"):
+        """
+        Find the runs a file of a subject has been split into
+        :param int sub_id: Numerical subject ID
+        :param str datatype: BIDS datatype folder, e.g. eeg
+        :param str suffix: BIDS suffix, e.g. events
+        :param str extension: File extension
+        :return list: Run numbers, [None] if the data has not been split into runs
+        """
+        unsplit = str(self.path(sub_id, datatype, suffix, extension).fpath)
+        pattern = f"{unsplit[:-len(suffix + extension)]}run-*_{suffix}{extension}"
+        return sorted(int(get_entities_from_fname(path)["run"]) for path in glob.glob(pattern)) or [None]
+
+    def _table(self, path, dtype=None):
+        """
+        Read a TSV file through the cache. 'n/a' cells become missing values.
+        :param BIDSPath path: Path of the file
+        :param dict dtype: Column types, others are inferred
+        :return pd.DataFrame: Parsed table. The cached table is shared, copy it before changing it in place
+        """
+        fpath = str(path.fpath)
+        key = (fpath, d.fingerprint(fpath))
+        table = self.cache.get(key)
+        if table is None:
+            table = pd.read_csv(fpath, sep="\t", na_values="n/a", keep_default_na=False)
+            if dtype:
+                table = table.astype({column: kind for column, kind in dtype.items() if column in table.columns})
+            self.cache.put(key, table)
+        return table
+
+    def events(self, sub_id, run=None):
+        """
+        :param int sub_id: Numerical subject ID
+        :param int run: Run number, see path()
+        :return pd.DataFrame: Typed *_events.tsv of the subject, see EVENTS_DTYPES
+        """
+        return self._table(self.path(sub_id, "eeg", "events", run=run), EVENTS_DTYPES)
+
+    def beh(self, sub_id, run=None):
+        """
+        :param int sub_id: Numerical subject ID
+        :param int run: Run number, see path()
+        :return pd.DataFrame: Typed *_beh.tsv of the subject
+        """
+        return self._table(self.path(sub_id, "beh", "beh", run=run))
+
+    def raw(self, sub_id, run=None):
+        """
+        Open the EEG recording of a subject. Only the header is read, data is read from disk when it is used.
+        :param int sub_id: Numerical subject ID
+        :param int run: Run number, see path()
+        :return mne.io.Raw: Recording
+        """
+        return read_raw_bids(self.path(sub_id, "eeg", "eeg", ".vhdr", run), verbose=False)
+
+    def load(self, sub_ids=None, tables=("events", "beh"), readers=READERS):
+        """
+        Load tables of several subjects in parallel. Loaded tables stay in the cache. Runs of a subject split into runs
+        are read one by one and concatenated, with their number in an added run column.
+        :param list sub_ids: Numerical subject IDs, all subjects if None
+        :param tuple tables: Names of tables to load (methods of this class, see TABLES), e.g. ("events",)
+        :param int readers: Number of files parsed at the same time
+        :return dict: Subject IDs mapped to dictionaries of table names and tables
+        """
+        sub_ids = list(self.subjects) if sub_ids is None else list(sub_ids)
+        jobs = [(sub_id, name, run) for sub_id in sub_ids for name in tables
+                for run in self.runs(sub_id, *TABLES[name])]
+        with ThreadPoolExecutor(max_workers=readers) as pool:
+            results = pool.map(lambda job: getattr(self, job[1])(job[0], job[2]), jobs)
+            parts = {sub_id: {name: [] for name in tables} for sub_id in sub_ids}
+            for (sub_id, name, run), table in zip(jobs, results):
+                parts[sub_id][name].append(table if run is None else table.assign(run=run))
+        return {sub_id: {name: found[0] if len(found) == 1 else pd.concat(found, ignore_index=True)
+                         for name, found in parts[sub_id].items()} for sub_id in sub_ids}
@@ -0,0 +1,341 @@
+"""
+Following code computes derivatives of the converted dataset, so that analyses can start from small preprocessed
+files instead of the raw recordings. Results are cached: a derivative is only computed anew if the raw data or the
+processing parameters change.
+
+Derivatives are written into BIDS_ROOT/derivatives/<pipeline>, following the BIDS derivatives specification:
+- preproc: band-pass filtered and resampled EEG data (*_desc-preproc_eeg.fif)
+- epochs: EEG epochs around decoded events as memory-mappable arrays (*_desc-<event>_epo.npy) with metadata tables
+- trials: one row per trial, assembled from the EEG markers (*_desc-trials_events.tsv, see trials.py)
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os
+import os.path as op
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import mne
+import textfiles
+import markers as m
+from mne_bids import BIDSPath, read_raw_bids
+
+# Default BIDS path.
+BIDS_ROOT = op.join(op.dirname(op.realpath(__file__)), "..")
+# Names of derivative pipelines (folders in BIDS_ROOT/derivatives)
+PREPROC = "preproc"
+EPOCHS = "epochs"
+QC = "qc"
+TRIALS = "trials"
+
+# Names and descriptions of derivatives datasets for dataset_description.json
+DESCRIPTIONS = {
+    PREPROC: ("mpib_memoreeg preprocessed EEG",
+              "Band-pass filtered and resampled EEG data, computed with MNE-Python from the raw BrainVision "
+              "recordings of the dataset."),
+    EPOCHS: ("mpib_memoreeg EEG epochs",
+             "EEG epochs around encoding, distractor and retrocue events, cut from the recordings of the dataset "
+             "and stored as NumPy arrays with metadata tables."),
+    QC: ("mpib_memoreeg quality control",
+         "Quality control tables of the dataset, e.g. EEG marker statistics per subject (qc.py)."),
+    TRIALS: ("mpib_memoreeg trials",
+             "Trial tables of the dataset: onsets, items, retrocue, key presses and feedback of every trial, "
+             "assembled from the EEG markers of the recordings (trials.py)."),
+}
+
+# Default preprocessing parameters: band-pass filter edges and new sampling rate (Hz)
+L_FREQ = 0.1
+H_FREQ = 40.0
+SFREQ = 250.0
+# How many channels are filtered at once? Memory use is bounded by one chunk at the acquisition rate plus the
+# (much smaller) resampled result.
+CHUNK_CHANNELS = 16
+# How many cores does the filtering of one recording use?
+N_JOBS = 2
+
+# Default epoching windows (seconds relative to the event onset) for event types in *_events.tsv
+EPOCH_WINDOWS = {
+    "encoding": (-0.2, 1.0),
+    "distractor": (-0.2, 1.0),
+    "retrocue": (-0.2, 1.5),
+}
+# Columns of epoch metadata: columns of *_events.tsv, where the trial column (the trigger ID) is called trigger, and
+# run and trial, the numbers of the trial the event belongs to in the behavioral data (as in the trial tables of
+# trials.py, see markers.number_markers())
+EPOCH_METADATA = ["onset", "sample", "trigger", "run", "trial", "stim_file", "rotation", "position"]
+
+
+def derivatives_root(pipeline, bids_root=BIDS_ROOT):
+    """
+    Helper function to determine root folder of a derivative pipeline
+    :param str pipeline: Name of the pipeline, e.g. PREPROC
+    :param str bids_root: Location of the raw dataset
+    :return str: Path of the derivatives dataset
+    """
+    return op.join(bids_root, "derivatives", pipeline)
+
+
+def fingerprint(*paths):
+    """
+    Cheap fingerprint of files: their names, sizes and modification times. Reading multi-GB recordings to hash them
+    is not needed to notice that they have been written anew.
+    :param str paths: Paths of files to fingerprint
+    :return str: Hex digest, changes whenever one of the files changes
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{op.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def cache_key(raw_fingerprint, params):
+    """
+    Combine fingerprint of source data and processing parameters into a key identifying a derivative
+    :param str raw_fingerprint: Fingerprint of the source files, see fingerprint()
+    :param dict params: Processing parameters (JSON-serializable)
+    :return str: Hex digest
+    """
+    text = raw_fingerprint + json.dumps(params, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def is_cached(json_path, key):
+    """
+    Helper function to check whether a derivative has already been computed with the given cache key
+    :param json_path: JSON sidecar of the derivative, keeps the key of the last computation
+    :param str key: Cache key of the requested derivative
+    :return bool: True if the sidecar exists and carries the same key
+    """
+    if not op.exists(json_path):
+        return False
+    with open(json_path, "r", encoding="utf-8") as sidecar:
+        return json.load(sidecar).get("CacheKey") == key
+
+
+def raw_files(subject, bids_root=BIDS_ROOT):
+    """
+    Helper function to find the converted BrainVision files of a subject
+    :param subject.Subject subject: Subject to look for
+    :param str bids_root: Location of the raw dataset
+    :return list: Paths of .vhdr, .vmrk and .eeg files
+    """
+    vhdr_path = BIDSPath(subject=subject.id, task=subject.task, root=bids_root, datatype="eeg", suffix="eeg",
+                         extension=".vhdr")
+    return [str(vhdr_path.fpath)[:-len(".vhdr")] + ext for ext in [".vhdr", ".vmrk", ".eeg"]]
+
+
+def make_description(pipeline, bids_root=BIDS_ROOT):
+    """
+    Create dataset_description.json of a derivatives dataset
+    :param str pipeline: Name of the pipeline, e.g. PREPROC
+    :param str bids_root: Location of the raw dataset
+    """
+    root = derivatives_root(pipeline, bids_root)
+    os.makedirs(root, exist_ok=True)
+    name, description = DESCRIPTIONS[pipeline]
+    textfiles.write(textfiles.derivative_description(name, description), op.join(root, "dataset_description.json"))
+
+
+def preprocess(subject, bids_root=BIDS_ROOT, l_freq=L_FREQ, h_freq=H_FREQ, sfreq=SFREQ, chunk=CHUNK_CHANNELS,
+               n_jobs=N_JOBS):
+    """
+    Band-pass filter and resample EEG data of a subject into BIDS_ROOT/derivatives/preproc. Nothing is done if the
+    derivative already exists for the same raw data and parameters.
+    :param subject.Subject subject: Subject to preprocess
+    :param str bids_root: Location of the raw dataset
+    :param float l_freq: Lower edge of the band-pass filter (Hz), None for low-pass only
+    :param float h_freq: Upper edge of the band-pass filter (Hz), None for high-pass only
+    :param float sfreq: New sampling rate (Hz)
+    :param int chunk: Number of channels filtered at once
+    :param int n_jobs: Number of cores used for filtering
+    :return str: Path of the preprocessed file
+    """
+    raw_path = BIDSPath(subject=subject.id, task=subject.task, root=bids_root, datatype="eeg", suffix="eeg",
+                        extension=".vhdr")
+    out_path = BIDSPath(subject=subject.id, task=subject.task, root=derivatives_root(PREPROC, bids_root),
+                        datatype="eeg", suffix="eeg", description="preproc", extension=".fif", check=False)
+    json_path = str(out_path.fpath)[:-len(".fif")] + ".json"
+
+    # Skip if nothing changed since the last computation
+    params = {"l_freq": l_freq, "h_freq": h_freq, "sfreq": sfreq, "mne": mne.__version__}
+    raw_fingerprint = fingerprint(*raw_files(subject, bids_root))
+    key = cache_key(raw_fingerprint, params)
+    if op.exists(out_path.fpath) and is_cached(json_path, key):
+        return str(out_path.fpath)
+
+    # Read lazily (channel types are taken from channels.tsv) and process a few channels at a time
+    raw = read_raw_bids(raw_path, verbose=False)
+    parts = []
+    for start in range(0, len(raw.ch_names), chunk):
+        part = raw.copy().pick_channels(raw.ch_names[start:start + chunk], ordered=True).load_data()
+        part.filter(l_freq, h_freq, picks="all", n_jobs=n_jobs, verbose=False)
+        part.resample(sfreq, n_jobs=n_jobs, verbose=False)
+        parts.append(part)
+    preprocessed = parts[0].add_channels(parts[1:]) if len(parts) > 1 else parts[0]
+
+    out_path.mkdir()
+    preprocessed.save(out_path.fpath, overwrite=True, verbose=False)
+
+    # Provenance sidecar: where the data comes from and how it has been processed
+    sidecar = {
+        "Description": "Band-pass filtered and resampled EEG data",
+        "Sources": [f"bids:raw:{op.relpath(raw_path.fpath, bids_root)}"],
+        "SamplingFrequency": sfreq,
+        "SoftwareFilters": {
+            "BandPass": {
+                "LowCutoff": l_freq,
+                "HighCutoff": h_freq,
+                "Description": "FIR filter (MNE-Python default design), applied to all channels before resampling"
+            }
+        },
+        "SoftwareVersions": f"MNE-Python {mne.__version__}",
+        "RawFingerprint": raw_fingerprint,
+        "CacheKey": key
+    }
+    textfiles.write(sidecar, json_path)
+    return str(out_path.fpath)
+
+
+def epochs_path(subject, event, bids_root=BIDS_ROOT, extension=".npy"):
+    """
+    Helper function to determine location of cached epochs of a subject
+    :param subject.Subject subject: Subject the epochs belong to
+    :param str event: Event type the epochs are cut around, e.g. encoding
+    :param str bids_root: Location of the raw dataset
+    :param str extension: .npy for the data, .tsv for the metadata, .json for the sidecar
+    :return str: Path of the file
+    """
+    path = BIDSPath(subject=subject.id, task=subject.task, root=derivatives_root(EPOCHS, bids_root), datatype="eeg",
+                    suffix="epo", description=event, extension=extension, check=False)
+    return str(path.fpath)
+
+
+def epoch(subject, bids_root=BIDS_ROOT, windows=None, preprocessed=False):
+    """
+    Cut EEG data of a subject into epochs around decoded events and cache them in BIDS_ROOT/derivatives/epochs.
+    Every event type gets an array of shape (epochs, channels, times) in a .npy file, which can be memory-mapped,
+    and a metadata table with one row per epoch. Event types are only cut again if the events, the EEG data or the
+    window change.
+    :param subject.Subject subject: Subject to cut epochs for
+    :param str bids_root: Location of the raw dataset
+    :param dict windows: Event types mapped to (tmin, tmax) in seconds. Default: EPOCH_WINDOWS
+    :param bool preprocessed: Cut epochs from preprocessed data (see preprocess()) instead of raw data
+    :return dict: Event types mapped to paths of the .npy files
+    """
+    windows = windows or EPOCH_WINDOWS
+    events_path = BIDSPath(subject=subject.id, task=subject.task, root=bids_root, datatype="eeg", suffix="events",
+                           extension=".tsv")
+    # Trials are numbered with the behavioral data
+    beh_path = BIDSPath(subject=subject.id, task=subject.task, root=bids_root, datatype="beh", suffix="beh",
+                        extension=".tsv")
+    if preprocessed:
+        data_path = BIDSPath(subject=subject.id, task=subject.task, root=derivatives_root(PREPROC, bids_root),
+                             datatype="eeg", suffix="eeg", description="preproc", extension=".fif", check=False)
+        data_files = [str(data_path.fpath)]
+    else:
+        data_files = raw_files(subject, bids_root)
+    sources = data_files + [str(events_path.fpath)]
+    if op.exists(beh_path.fpath):
+        sources.append(str(beh_path.fpath))
+    source_fingerprint = fingerprint(*sources)
+
+    raw = None
+    events = None
+    written = {}
+    for event, (tmin, tmax) in windows.items():
+        npy_path = epochs_path(subject, event, bids_root)
+        json_path = epochs_path(subject, event, bids_root, ".json")
+        key = cache_key(source_fingerprint, {"event": event, "tmin": tmin, "tmax": tmax, "preprocessed": preprocessed,
+                                             "metadata": EPOCH_METADATA})
+        written[event] = npy_path
+        if op.exists(npy_path) and is_cached(json_path, key):
+            continue
+
+        # Data is read lazily, only windows around the events are loaded from disk
+        if raw is None:
+            if preprocessed:
+                raw = mne.io.read_raw_fif(data_files[0], preload=False, verbose=False)
+            else:
+                raw = mne.io.read_raw_brainvision(data_files[0], preload=False, verbose=False)
+            events = pd.read_csv(events_path.fpath, sep="\t", na_values="n/a")
+            events = events.rename(columns={"trial": "trigger"})
+            # Events are matched with the source markers, which are split into trials and numbered like in trials.py
+            samples, codes, types = subject.triggers()
+            starts = [start for start, _ in subject.eeg_segments()]
+            run, trial, _ = m.number_markers(samples, types, m.behavioral_trials(subject), starts)
+            numbers = pd.DataFrame({"sample": samples, "trigger": codes, "run": run, "trial": trial})
+            events = events.merge(numbers.drop_duplicates(["sample", "trigger"]), on=["sample", "trigger"], how="left")
+
+        # Onsets in *_events.tsv are seconds from the beginning of the recording. Epochs reaching over the
+        # beginning or the end of the recording are left out.
+        sfreq = raw.info["sfreq"]
+        n_times = int(round((tmax - tmin) * sfreq)) + 1
+        chosen = events[events.event == event]
+        starts = np.round((chosen.onset.to_numpy() + tmin) * sfreq).astype(int)
+        inside = (starts >= 0) & (starts + n_times <= raw.n_times)
+        chosen = chosen[inside]
+        starts = starts[inside]
+
+        # Write into a temporary file first, so that an interrupted run never leaves a valid-looking cache behind
+        os.makedirs(op.dirname(npy_path), exist_ok=True)
+        tmp_path = npy_path + ".tmp"
+        data = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                         shape=(len(starts), len(raw.ch_names), n_times))
+        for index, start in enumerate(starts):
+            data[index] = raw.get_data(start=start, stop=start + n_times)
+        data.flush()
+        del data
+        os.replace(tmp_path, npy_path)
+
+        chosen[EPOCH_METADATA].to_csv(epochs_path(subject, event, bids_root, ".tsv"), index=False, na_rep="n/a",
+                                      sep="\t")
+        sidecar = {
+            "Description": f"EEG epochs around {event} events, array of shape (epochs, channels, times)",
+            "Sources": [f"bids:raw:{op.relpath(path, bids_root)}" for path in sources],
+            "EpochWindow": [tmin, tmax],
+            "SamplingFrequency": sfreq,
+            "Units": "V",
+            "ChannelNames": raw.ch_names,
+            "SourceFingerprint": source_fingerprint,
+            "CacheKey": key
+        }
+        textfiles.write(sidecar, json_path)
+    return written
+
+
+def load_epochs(subject, event, bids_root=BIDS_ROOT, query=None):
+    """
+    Load cached epochs of a subject, see epoch(). Only the chosen epochs are read from disk.
+    :param subject.Subject subject: Subject the epochs belong to
+    :param str event: Event type the epochs are cut around, e.g. encoding
+    :param str bids_root: Location of the raw dataset
+    :param str query: Condition on the metadata to choose epochs (pandas query syntax), e.g. "rotation > 90".
+    If None, the complete array is returned memory-mapped (nothing is read until it is used)
+    :return tuple: (epochs array, metadata dataframe)
+    """
+    data = np.load(epochs_path(subject, event, bids_root), mmap_mode="r")
+    metadata = pd.read_csv(epochs_path(subject, event, bids_root, ".tsv"), sep="\t", na_values="n/a",
+                           dtype={"run": "Int64", "trial": "Int64"})
+    if query is None:
+        return data, metadata
+    chosen = metadata.query(query)
+    return np.asarray(data[chosen.index.to_numpy()]), chosen.reset_index(drop=True)
@@ -0,0 +1,325 @@
+"""
+Following code checks that changes to the conversion do not change its results: it converts a small fixture source
+dataset (same structure as sourcedata, with a few subjects) and compares every produced file against stored golden
+outputs. TSV files are compared cell by cell, JSON files by content (independent of formatting and key order), other
+text files line by line and binary files (e.g. EEG data) by hash.
+
+The conversion can take one of two code paths, so a faster path can be checked against the plain one in the same run:
+- reference: subjects and dataset-level files one after another, with the original implementations of the subject
+  conversion (see reference.py), as the script did originally
+- pipeline: the task graph of source2bids.py, with staging and parallel workers
+
+Run from the BIDS_ROOT/code folder:
+
+python golden.py record FIXTURE GOLDEN [--path reference]          # convert and store results as golden outputs
+python golden.py check FIXTURE GOLDEN [--path reference pipeline]  # convert and compare results with golden outputs
+python golden.py compare EXPECTED ACTUAL                           # compare two converted datasets
+
+A synthetic fixture and its golden outputs, recorded with the reference path, are kept in fixtures/sourcedata and
+fixtures/golden.
+
+LICENSE is not written, it is downloaded rather than produced by the conversion.
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os
+import os.path as op
+import re
+import sys
+import glob
+import shutil
+import difflib
+import argparse
+import tempfile
+from contextlib import contextmanager
+import pipeline as p
+import staging
+import inheritance
+import manifest
+import reference
+import source2bids
+import sources
+
+# Tasks of the pipeline which are not run: LICENSE is downloaded, not produced by the conversion
+SKIP_TASKS = ["license"]
+# File extensions compared as TSV tables, JSON documents and text. Everything else is compared by hash.
+TSV = [".tsv"]
+JSON = [".json"]
+TEXT = [".vhdr", ".vmrk", ".md", ".txt", ""]
+# How many differences are reported per file?
+MAX_DIFFS = 20
+
+
+@contextmanager
+def _redirect(data_path, bids_root):
+    """
+    Helper context manager to let the dataset-level functions of source2bids.py read from and write to other folders
+    :param str data_path: Root folder with source data
+    :param str bids_root: Location of the dataset to write
+    """
+    saved = source2bids.DATA_PATH, source2bids.BIDS_ROOT, source2bids.FRAGMENTS
+    source2bids.DATA_PATH = data_path
+    source2bids.BIDS_ROOT = bids_root
+    source2bids.FRAGMENTS = op.join(bids_root, ".fragments")
+    try:
+        yield
+    finally:
+        source2bids.DATA_PATH, source2bids.BIDS_ROOT, source2bids.FRAGMENTS = saved
+
+
+def fixture_subjects(data_path):
+    """
+    Find subjects of a fixture dataset: every subject with behavioral data, as a plain file or in an archive
+    :param str data_path: Root folder with source data
+    :return list: Numerical subject IDs
+    """
+    files = {op.relpath(path, data_path).replace(os.sep, "/")
+             for path in glob.glob(op.join(data_path, "behavioral", "resultfile_p*.txt"))}
+    files |= set(sources.open_source(data_path).members())
+    matches = [re.fullmatch(r"behavioral/resultfile_p(\d+)\.txt", path) for path in files]
+    return sorted({int(match.group(1)) for match in matches if match})
+
+
+def convert_reference(data_path, bids_root, sub_ids):
+    """
+    Convert subjects and write dataset-level files one after another, without staging. Subjects are converted with the
+    original implementations of reference.py.
+    :param str data_path: Root folder with source data
+    :param str bids_root: Location of the dataset to write
+    :param list sub_ids: Numerical subject IDs
+    """
+    with _redirect(data_path, bids_root):
+        for participant in source2bids.read_participants(sub_ids, data_path):
+            source2bids.make_participant_fragment(participant)
+            # The original implementations read plain files, so files kept in archives are extracted first
+            eeg_files = [op.splitext(participant.vhdr_path)[0] + ext for ext in ['.vhdr', '.vmrk', '.eeg']]
+            participant.source.prefetch(eeg_files + [participant.beh_path])
+            reference.eeg_to_bids(participant, bids_root)
+            reference.beh_to_bids(participant, bids_root)
+        source2bids.make_participants()
+        source2bids.make_stimuli()
+        source2bids.make_dataset_description()
+        source2bids.make_participants_json()
+        source2bids.make_readme()
+        source2bids.make_changes()
+        source2bids.make_bidsignore()
+        source2bids.make_bids_validator_config()
+        if source2bids.INHERIT_SIDECARS:
+            inheritance.deduplicate_all(bids_root)
+
+
+def convert_pipeline(data_path, bids_root, sub_ids):
+    """
+    Convert subjects and write dataset-level files with the task graph of source2bids.py
+    :param str data_path: Root folder with source data
+    :param str bids_root: Location of the dataset to write
+    :param list sub_ids: Numerical subject IDs
+    """
+    with _redirect(data_path, bids_root):
+        pipeline = p.Pipeline()
+        journal = staging.Journal(op.join(bids_root, staging.STAGING, "journal.tsv"))
+        source2bids.add_subject_tasks(pipeline, source2bids.read_participants(sub_ids, data_path), journal)
+        source2bids.add_merge_tasks(pipeline)
+        pipeline.tasks = [task for task in pipeline.tasks if task.name not in SKIP_TASKS]
+        pipeline.run(cpu_jobs=source2bids.CPU_JOBS, io_jobs=source2bids.IO_JOBS,
+                     memory_budget=source2bids.MEMORY_BUDGET)
+
+
+# Code paths of the conversion
+PATHS = {
+    "reference": convert_reference,
+    "pipeline": convert_pipeline,
+}
+
+
+def _read_tsv(path):
+    with open(path, "r", encoding="utf-8") as table:
+        return [line.rstrip("\n").split("\t") for line in table]
+
+
+def compare_tsv(expected, actual):
+    """
+    Compare two TSV files cell by cell
+    :param str expected: Path of the golden file
+    :param str actual: Path of the produced file
+    :return list: Descriptions of differences
+    """
+    old, new = _read_tsv(expected), _read_tsv(actual)
+    if old[:1] != new[:1]:
+        return [f"columns: {old[0] if old else []} != {new[0] if new else []}"]
+    diffs = []
+    if len(old) != len(new):
+        diffs.append(f"rows: {len(old) - 1} != {len(new) - 1}")
+    columns = old[0] if old else []
+    for row, (old_row, new_row) in enumerate(zip(old[1:], new[1:]), start=1):
+        for column, (old_cell, new_cell) in enumerate(zip(old_row, new_row)):
+            if old_cell != new_cell:
+                name = columns[column] if column < len(columns) else column
+                diffs.append(f"row {row}, {name}: {old_cell!r} != {new_cell!r}")
+        if len(old_row) != len(new_row):
+            diffs.append(f"row {row}: {len(old_row)} != {len(new_row)} cells")
+    return diffs
+
+
+def _flatten(value, prefix=""):
+    """
+    Helper function to turn nested JSON into {"a/b/0": value} pairs, so that differences can be named exactly
+    """
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return {prefix: value}
+    flat = {}
+    for key, item in items:
+        flat.update(_flatten(item, f"{prefix}/{key}" if prefix else str(key)))
+    return flat or {prefix: value}
+
+
+def compare_json(expected, actual):
+    """
+    Compare two JSON files by content: formatting and key order do not matter
+    :param str expected: Path of the golden file
+    :param str actual: Path of the produced file
+    :return list: Descriptions of differences
+    """
+    old, new = _flatten(inheritance.read(expected)), _flatten(inheritance.read(actual))
+    diffs = [f"{key}: missing" for key in old if key not in new]
+    diffs += [f"{key}: unexpected {new[key]!r}" for key in new if key not in old]
+    diffs += [f"{key}: {old[key]!r} != {new[key]!r}" for key in old if key in new and old[key] != new[key]]
+    return diffs
+
+
+def compare_text(expected, actual):
+    """
+    Compare two text files line by line
+    :param str expected: Path of the golden file
+    :param str actual: Path of the produced file
+    :return list: Changed lines as a unified diff
+    """
+    with open(expected, "r", encoding="utf-8", errors="replace") as old, \
+            open(actual, "r", encoding="utf-8", errors="replace") as new:
+        diff = difflib.unified_diff(old.read().splitlines(), new.read().splitlines(), lineterm="", n=0)
+    return [line for line in diff if not line.startswith(("---", "+++"))]
+
+
+def compare_binary(expected, actual):
+    """
+    Compare two files by hash
+    :param str expected: Path of the golden file
+    :param str actual: Path of the produced file
+    :return list: Description of the difference, if any
+    """
+    old, new = manifest.sha256(expected), manifest.sha256(actual)
+    return [] if old == new else [f"sha256: {old} != {new}"]
+
+
+def compare_file(expected, actual):
+    """
+    Compare two files according to their type, see TSV, JSON and TEXT
+    :return list: Descriptions of differences
+    """
+    extension = op.splitext(expected)[1]
+    if extension in TSV:
+        return compare_tsv(expected, actual)
+    if extension in JSON:
+        return compare_json(expected, actual)
+    if extension in TEXT:
+        return compare_text(expected, actual)
+    return compare_binary(expected, actual)
+
+
+def compare_trees(expected_root, actual_root):
+    """
+    Compare all output files of two datasets (see manifest.output_files())
+    :param str expected_root: Location of the golden dataset
+    :param str actual_root: Location of the produced dataset
+    :return dict: Relative paths of differing files mapped to descriptions of differences
+    """
+    old, new = set(manifest.output_files(expected_root)), set(manifest.output_files(actual_root))
+    diffs = {path: ["missing"] for path in old - new}
+    diffs.update({path: ["unexpected"] for path in new - old})
+    for path in sorted(old & new):
+        file_diffs = compare_file(op.join(expected_root, path), op.join(actual_root, path))
+        if file_diffs:
+            diffs[path] = file_diffs
+    return diffs
+
+
+def report(diffs, title):
+    """
+    Print differences, see compare_trees()
+    :param dict diffs: Differences
+    :param str title: What has been compared
+    :return bool: True if there are no differences
+    """
+    print(f"{title}: {'identical' if not diffs else f'{len(diffs)} file(s) differ'}")
+    for path in sorted(diffs):
+        print(f"    {path}")
+        for line in diffs[path][:MAX_DIFFS]:
+            print(f"        {line}")
+        if len(diffs[path]) > MAX_DIFFS:
+            print(f"        ... {len(diffs[path]) - MAX_DIFFS} more")
+    return not diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare conversion results with golden outputs.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='Convert the fixture and store results as golden outputs.')
+    check = commands.add_parser('check', help='Convert the fixture and compare results with golden outputs.')
+    for command in [record, check]:
+        command.add_argument('fixture', help='Source data folder of the fixture (like sourcedata).')
+        command.add_argument('golden', help='Folder with golden outputs.')
+        command.add_argument('--subjects', type=source2bids.parse_subjects,
+                             help='Subjects to convert, default: all subjects with behavioral data.')
+    record.add_argument('--path', choices=PATHS, default='reference', help='Code path of the conversion.')
+    check.add_argument('--path', choices=PATHS, nargs='+', default=list(PATHS), help='Code paths to check.')
+    compare = commands.add_parser('compare', help='Compare two converted datasets.')
+    compare.add_argument('expected')
+    compare.add_argument('actual')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        sys.exit(0 if report(compare_trees(args.expected, args.actual), 'compare') else 1)
+
+    fixture = op.realpath(args.fixture)
+    sub_ids = args.subjects or fixture_subjects(fixture)
+    if args.command == 'record':
+        shutil.rmtree(args.golden, ignore_errors=True)
+        os.makedirs(args.golden)
+        PATHS[args.path](fixture, op.realpath(args.golden), sub_ids)
+        # Working folders of the conversion are not part of the results
+        for folder in [staging.STAGING, ".fragments"]:
+            shutil.rmtree(op.join(args.golden, folder), ignore_errors=True)
+        print(f'{len(manifest.output_files(args.golden))} golden files in {args.golden}')
+        return
+
+    identical = True
+    for path in args.path:
+        with tempfile.TemporaryDirectory() as bids_root:
+            PATHS[path](fixture, bids_root, sub_ids)
+            identical &= report(compare_trees(args.golden, bids_root), path)
+    sys.exit(0 if identical else 1)
+
+
+if __name__ == '__main__':
+    main()
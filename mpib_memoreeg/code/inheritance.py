@@ -0,0 +1,203 @@
+"""
+Following code deduplicates JSON sidecars of the dataset using the BIDS inheritance principle: key/value pairs which
+are the same for all subjects of a task are moved into one sidecar at the dataset root (e.g.
+task-distractor_events.json), subject sidecars keep only what is specific to the subject. Subject sidecars without
+any specific content are removed. Keys which MNE-BIDS reads (see SUBJECT_KEYS) stay in the subject sidecars, since
+read_raw_bids() ignores dataset-level sidecars.
+
+Subject sidecars may be written in full (e.g. by a new conversion) at any time: the root sidecar is merged back before
+deduplicating again. The merged content of every sidecar is checked after writing to stay exactly the same, otherwise
+all files touched are restored as they were and an error is raised.
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os
+import os.path as op
+import glob
+import json
+import textfiles
+from mne_bids import get_bids_path_from_fname, read_raw_bids
+
+# Tasks of the dataset and sidecars to deduplicate, as (datatype, suffix)
+TASKS = ["distractor", "nodistractor"]
+SIDECARS = [("eeg", "eeg"), ("eeg", "events"), ("beh", "beh")]
+# Keys which always stay in subject sidecars, by suffix: MNE-BIDS (read_raw_bids) reads sidecars of recordings from the
+# subject folder only, dataset-level sidecars are ignored. Subject sidecars with such keys are kept as files.
+SUBJECT_KEYS = {"eeg": ["PowerLineFrequency", "SamplingFrequency", "EEGReference", "ContinuousHeadLocalization",
+                        "HeadCoilFrequency"]}
+
+
+def read(path):
+    """
+    Helper function to read a JSON sidecar
+    :param str path: Path of the sidecar
+    :return dict: Contents, empty if the file does not exist
+    """
+    if not op.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as sidecar:
+        return json.load(sidecar)
+
+
+def root_path(bids_root, task, suffix):
+    """
+    Helper function to determine location of a dataset-level sidecar
+    :param str bids_root: Location of the dataset
+    :param str task: Task name, e.g. distractor
+    :param str suffix: Sidecar suffix, e.g. events
+    :return str: Path of the sidecar, e.g. BIDS_ROOT/task-distractor_events.json
+    """
+    return op.join(bids_root, f"task-{task}_{suffix}.json")
+
+
+def subject_paths(bids_root, task, datatype, suffix):
+    """
+    Helper function to find subject-level sidecars of a task (including sidecars of single runs). Sidecars are
+    found through their data files as well, since a sidecar with nothing subject-specific does not exist as a file.
+    :param str bids_root: Location of the dataset
+    :param str task: Task name, e.g. distractor
+    :param str datatype: BIDS datatype folder, e.g. eeg
+    :param str suffix: Sidecar suffix, e.g. events
+    :return list: Paths of the sidecars
+    """
+    files = glob.glob(op.join(bids_root, "sub-*", datatype, f"sub-*_task-{task}_*{suffix}.*"))
+    return sorted({op.splitext(path)[0] + ".json" for path in files})
+
+
+def effective(path, bids_root, task, suffix):
+    """
+    Contents of a subject sidecar as seen by a BIDS reader: dataset-level sidecar overridden by the subject one
+    :param str path: Path of the subject sidecar
+    :param str bids_root: Location of the dataset
+    :param str task: Task name, e.g. distractor
+    :param str suffix: Sidecar suffix, e.g. events
+    :return dict: Merged contents
+    """
+    return {**read(root_path(bids_root, task, suffix)), **read(path)}
+
+
+def _snapshot(path):
+    """
+    Helper function to keep the raw contents of a file before it is rewritten
+    :param str path: Path of the file
+    :return bytes: Contents, None if the file does not exist
+    """
+    if not op.exists(path):
+        return None
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def _restore(path, raw):
+    """
+    Helper function to put back a file kept by _snapshot()
+    :param str path: Path of the file
+    :param bytes raw: Contents, None to remove the file
+    """
+    if raw is None:
+        if op.exists(path):
+            os.remove(path)
+        return
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(raw)
+    os.replace(temporary, path)
+
+
+def readable(path, contents):
+    """
+    Check that MNE-BIDS reads a recording sidecar as expected: read_raw_bids() finds it and takes the power line
+    frequency from it
+    :param str path: Path of the subject sidecar, e.g. sub-01/eeg/sub-01_task-distractor_eeg.json
+    :param dict contents: Expected contents
+    :return bool: True if the recording is read with the expected power line frequency (or there is no recording)
+    """
+    # Recordings of the dataset are BrainVision files
+    vhdr_path = op.splitext(path)[0] + ".vhdr"
+    if not op.exists(vhdr_path):
+        return True
+    raw = read_raw_bids(get_bids_path_from_fname(vhdr_path), verbose=False)
+    return raw.info["line_freq"] == contents.get("PowerLineFrequency")
+
+
+def deduplicate(bids_root, task, datatype, suffix):
+    """
+    Move key/value pairs shared by all subject sidecars of a task into the dataset-level sidecar
+    :param str bids_root: Location of the dataset
+    :param str task: Task name, e.g. distractor
+    :param str datatype: BIDS datatype folder, e.g. eeg
+    :param str suffix: Sidecar suffix, e.g. events
+    :return list: Paths of written or removed files
+    """
+    paths = subject_paths(bids_root, task, datatype, suffix)
+    if not paths:
+        return []
+    root_file = root_path(bids_root, task, suffix)
+    root = read(root_file)
+    merged = {path: {**root, **read(path)} for path in paths}
+
+    # Shared are keys with the same value in every sidecar (keys keep the order of the first sidecar), except for keys
+    # MNE-BIDS reads
+    first = merged[paths[0]]
+    shared = {key: value for key, value in first.items() if key not in SUBJECT_KEYS.get(suffix, [])
+              and all(key in contents and contents[key] == value for contents in merged.values())}
+
+    # Raw contents of every touched file before deduplicating (None if missing), to roll back on a failed check
+    snapshot = {path: _snapshot(path) for path in paths + [root_file]}
+    changed = []
+    try:
+        for path, contents in merged.items():
+            specific = {key: value for key, value in contents.items() if key not in shared}
+            if specific:
+                if specific != read(path):
+                    textfiles.write(specific, path)
+                    changed.append(path)
+            elif op.exists(path):
+                os.remove(path)
+                changed.append(path)
+
+        if shared != root:
+            textfiles.write(shared, root_file)
+            changed.append(root_file)
+
+        # What a reader sees afterwards has to be exactly what has been there before, MNE-BIDS included
+        for path, contents in merged.items():
+            if effective(path, bids_root, task, suffix) != contents:
+                raise ValueError(f"Deduplicating {path} would change its contents")
+            if suffix in SUBJECT_KEYS and not readable(path, contents):
+                raise ValueError(f"Deduplicating {path} would hide its contents from MNE-BIDS")
+    except Exception:
+        for path, raw in snapshot.items():
+            _restore(path, raw)
+        raise
+    return changed
+
+
+def deduplicate_all(bids_root):
+    """
+    Deduplicate all sidecars listed in SIDECARS for all TASKS
+    :param str bids_root: Location of the dataset
+    :return list: Paths of written or removed files
+    """
+    changed = []
+    for task in TASKS:
+        for datatype, suffix in SIDECARS:
+            changed += deduplicate(bids_root, task, datatype, suffix)
+    return changed
@@ -0,0 +1,190 @@
+"""
+Following code writes a checksum manifest of all output files of the dataset (BIDS_ROOT/.manifest.tsv: path, size,
+modification time and SHA-256 of every file) and uses it to prove the dataset is intact or to see what changed.
+Files are hashed by a pool of parallel readers. Source data, code and hidden folders are not part of the manifest.
+
+Run from the BIDS_ROOT/code folder:
+
+python manifest.py build                  # hash all files and write the manifest
+python manifest.py verify [--full]        # re-hash files whose size or modification time changed (all with --full)
+python manifest.py diff OLD.tsv NEW.tsv   # list added, removed and changed files between two builds
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os
+import os.path as op
+import sys
+import argparse
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Default BIDS path and manifest location.
+BIDS_ROOT = op.join(op.dirname(op.realpath(__file__)), "..")
+MANIFEST = op.join(BIDS_ROOT, ".manifest.tsv")
+# Top-level folders which are not outputs of the conversion
+EXCLUDE = ["sourcedata", "code"]
+# Number of parallel readers. Hashing releases the GIL, so threads keep the disks busy.
+READERS = 16
+# Block size for reading files
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def sha256(path):
+    """
+    Helper function to hash a file block by block
+    :param str path: Path of the file
+    :return str: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as data:
+        for block in iter(lambda: data.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def output_files(bids_root=BIDS_ROOT):
+    """
+    Find all output files of the dataset: everything except EXCLUDE folders, hidden folders and the manifest itself
+    :param str bids_root: Location of the dataset
+    :return list: Paths relative to bids_root, with forward slashes
+    """
+    files = []
+    for folder, subfolders, names in os.walk(bids_root):
+        relative = op.relpath(folder, bids_root)
+        subfolders[:] = [name for name in subfolders if not name.startswith(".")
+                         and not (relative == "." and name in EXCLUDE)]
+        for name in names:
+            path = op.normpath(op.join(relative, name)).replace(os.sep, "/")
+            if path != op.basename(MANIFEST):
+                files.append(path)
+    return sorted(files)
+
+
+def build(bids_root=BIDS_ROOT, previous=None, readers=READERS):
+    """
+    Stat and hash all output files. Files whose size and modification time are the same as in a previous manifest
+    keep their previous hash and are not read.
+    :param str bids_root: Location of the dataset
+    :param dict previous: Previous manifest, see read(). None to hash everything
+    :param int readers: Number of files hashed at the same time
+    :return dict: Manifest: relative paths mapped to (size, mtime_ns, sha256)
+    """
+    previous = previous or {}
+    manifest = {}
+    to_hash = []
+    for path in output_files(bids_root):
+        stat = os.stat(op.join(bids_root, path))
+        entry = previous.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            manifest[path] = entry
+        else:
+            manifest[path] = (stat.st_size, stat.st_mtime_ns, None)
+            to_hash.append(path)
+
+    with ThreadPoolExecutor(max_workers=readers) as pool:
+        for path, digest in zip(to_hash, pool.map(sha256, [op.join(bids_root, path) for path in to_hash])):
+            size, mtime, _ = manifest[path]
+            manifest[path] = (size, mtime, digest)
+    return manifest
+
+
+def read(path=MANIFEST):
+    """
+    Read a manifest file
+    :param str path: Location of the manifest
+    :return dict: Manifest: relative paths mapped to (size, mtime_ns, sha256)
+    """
+    manifest = {}
+    with open(path, "r", encoding="utf-8") as lines:
+        next(lines)  # header
+        for line in lines:
+            name, size, mtime, digest = line.rstrip("\n").split("\t")
+            manifest[name] = (int(size), int(mtime), digest)
+    return manifest
+
+
+def write(manifest, path=MANIFEST):
+    """
+    Write a manifest file. The file is replaced at once, an interrupted run keeps the previous manifest
+    :param dict manifest: Manifest, see build()
+    :param str path: Location of the manifest
+    """
+    with open(path + ".tmp", "w", encoding="utf-8") as output:
+        output.write("path\tsize\tmtime_ns\tsha256\n")
+        for name in sorted(manifest):
+            size, mtime, digest = manifest[name]
+            output.write(f"{name}\t{size}\t{mtime}\t{digest}\n")
+    os.replace(path + ".tmp", path)
+
+
+def diff(old, new):
+    """
+    Compare two manifests by content
+    :param dict old: Earlier manifest
+    :param dict new: Later manifest
+    :return tuple: Lists of added, removed and changed paths
+    """
+    added = sorted(set(new) - set(old))
+    removed = sorted(set(old) - set(new))
+    changed = sorted(path for path in set(old) & set(new) if old[path][2] != new[path][2])
+    return added, removed, changed
+
+
+def report(added, removed, changed):
+    """
+    Print a diff, see diff()
+    :return bool: True if there are no differences
+    """
+    for sign, paths in [("+", added), ("-", removed), ("M", changed)]:
+        for path in paths:
+            print(f"{sign} {path}")
+    print(f"{len(added)} added, {len(removed)} removed, {len(changed)} changed")
+    return not (added or removed or changed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Checksum manifest of the MemorEEG BIDS dataset.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('build', help='Hash all output files and write the manifest.')
+    verify = commands.add_parser('verify', help='Compare output files with the manifest.')
+    verify.add_argument('--full', action='store_true', help='Re-hash all files, not only changed ones.')
+    verify.add_argument('--update', action='store_true', help='Write the new state into the manifest.')
+    compare = commands.add_parser('diff', help='Compare two manifests.')
+    compare.add_argument('old')
+    compare.add_argument('new')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        manifest = build(BIDS_ROOT)
+        write(manifest)
+        print(f'{len(manifest)} files in {MANIFEST}')
+    elif args.command == 'verify':
+        old = read()
+        new = build(BIDS_ROOT, None if args.full else old)
+        intact = report(*diff(old, new))
+        if args.update:
+            write(new)
+        sys.exit(0 if intact else 1)
+    else:
+        sys.exit(0 if report(*diff(read(args.old), read(args.new))) else 1)
+
+
+if __name__ == '__main__':
+    main()
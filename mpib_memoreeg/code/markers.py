@@ -0,0 +1,243 @@
+"""
+Following code defines how the EEG markers of a recording form trials, for all scripts working with trials (qc.py,
+trials.py and epochs in derivatives.py): every marker is assigned to a trial, the markers of a trial are summarized in a
+single row and trials get the run and trial numbers of the behavioral data.
+
+A trial ends with its feedback marker, everything after it belongs to the next trial; an interruption of the recording
+(New Segment marker) ends an incomplete trial as well. Trials without a feedback marker are incomplete. Markers are
+handled with array operations on the trigger codes, the recordings themselves are not loaded.
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import numpy as np
+import pandas as pd
+import subject as s
+
+# Number of encoding items shown in every trial
+ITEMS = 2
+# Event type indices for quicker comparisons
+ENCODING, DISTRACTOR, POSITION, RETROCUE, FEEDBACK = (s.EVENT_TYPES.index(event) for event in
+                                                      ['encoding', 'distractor', 'position', 'retrocue', 'feedback'])
+# Key presses of a response, UP ends it
+RESPONSES = {event: s.EVENT_TYPES.index(event) for event in ['left', 'right', 'down', 'up']}
+UP = RESPONSES['up']
+
+
+def assign_trials(types, samples, starts=(0,)):
+    """
+    Assign every marker of a recording to a trial: the feedback closes a trial, everything after it belongs to the next
+    one. A new segment of the recording starts a new trial as well.
+    :param np.ndarray types: Event types of the markers (indices into subject.EVENT_TYPES), in recording order
+    :param np.ndarray samples: Marker positions in samples
+    :param starts: First samples of the segments of the recording, see Subject.eeg_segments()
+    :return tuple: (trial of every marker counted from 0, whether the trial of every marker is complete, i.e. has a
+    feedback, segment of every marker) as NumPy arrays
+    """
+    is_feedback = types == FEEDBACK
+    segment = np.searchsorted(np.asarray(starts), samples, side='right') - 1
+    boundary = np.concatenate([[False], is_feedback[:-1] | (segment[1:] != segment[:-1])])
+    trial = np.cumsum(boundary)
+    n_trials = int(trial[-1]) + 1 if len(trial) else 0
+    complete = np.bincount(trial[is_feedback], minlength=n_trials)[trial] > 0
+    return trial, complete, segment
+
+
+def _first(trial, mask, n_trials, last=False):
+    """
+    Helper function to find the first (or last) marker of a kind in every trial
+    :param np.ndarray trial: Trial index of every marker, in recording order
+    :param np.ndarray mask: Markers to look at
+    :param int n_trials: Number of trials
+    :param bool last: Find the last marker instead of the first one
+    :return np.ndarray: Marker index per trial, -1 where the trial has no such marker
+    """
+    chosen = np.flatnonzero(mask)
+    if last:
+        chosen = chosen[::-1]
+    found = np.full(n_trials, -1)
+    trials, where = np.unique(trial[chosen], return_index=True)
+    found[trials] = chosen[where]
+    return found
+
+
+def _pick(values, index, missing=np.nan):
+    """
+    Helper function to pick values of markers found by _first()
+    :return np.ndarray: Values, missing where the index is -1
+    """
+    return np.where(index >= 0, values[np.maximum(index, 0)], missing)
+
+
+def split_trials(samples, codes, types, sfreq, stim_files, starts=(0,)):
+    """
+    Split the markers of a recording into trials
+    :param np.ndarray samples: Marker positions in samples
+    :param np.ndarray codes: Trigger IDs of the markers
+    :param np.ndarray types: Event types of the markers (indices into subject.EVENT_TYPES)
+    :param float sfreq: Sampling rate of the recording (Hz)
+    :param np.ndarray stim_files: Stimulus file of every trigger ID from 0 to 255, see Subject.stim_codes()
+    :param starts: First samples of the segments of the recording, see Subject.eeg_segments()
+    :return pd.DataFrame: One row per complete trial with the segment it has been recorded in, missing numbers as NaN
+    and missing file names as n/a
+    """
+    # Incomplete trials (without feedback) are left out
+    trial, complete, segment = assign_trials(types, samples, starts)
+    is_feedback = types == FEEDBACK
+    n_trials = int(trial[-1]) + 1 if len(trial) else 0
+
+    onset = samples / sfreq
+    # Every object position is marked as a separate event right after the event encoding an object and its rotation
+    rotation = (codes % 20 - 1) * 22.5 + 11.25
+    next_position = np.concatenate([types[1:] == POSITION, [False]])
+    position = np.where(next_position, (np.concatenate([codes[1:], [0]]) % 200 - 1) * 22.5 + 11.25, np.nan)
+    files = stim_files[codes]
+
+    # Encoding items get their rank in the trial; trials without any (e.g. a stray feedback marker) are left out
+    encoding = np.flatnonzero((types == ENCODING) & complete)
+    n_encoding = np.bincount(trial[encoding], minlength=n_trials)
+    trials, first_item = np.unique(trial[encoding], return_index=True)
+    rank = np.arange(len(encoding)) - first_item[np.searchsorted(trials, trial[encoding])]
+
+    table = {}
+    first_encoding = _first(trial, (types == ENCODING) & complete, n_trials)
+    feedback = _first(trial, is_feedback, n_trials)
+    table['onset'] = _pick(onset, first_encoding)
+    table['duration'] = _pick(onset, feedback) - table['onset']
+    table['sample'] = _pick(samples, first_encoding, -1)
+    for item in range(ITEMS):
+        index = np.full(n_trials, -1)
+        index[trial[encoding[rank == item]]] = encoding[rank == item]
+        table[f'encoding_{item + 1}_onset'] = _pick(onset, index)
+        table[f'encoding_{item + 1}_object'] = _pick(files, index, 'n/a')
+        table[f'encoding_{item + 1}_rotation'] = _pick(rotation, index)
+        table[f'encoding_{item + 1}_position'] = _pick(position, index)
+    table['n_encoding'] = n_encoding
+
+    distractor = _first(trial, (types == DISTRACTOR) & complete, n_trials)
+    table['distractor_onset'] = _pick(onset, distractor)
+    table['distractor_object'] = _pick(files, distractor, 'n/a')
+    table['distractor_rotation'] = _pick(rotation, distractor)
+    table['distractor_position'] = _pick(position, distractor)
+
+    cue = _first(trial, (types == RETROCUE) & complete, n_trials)
+    table['cue'] = _pick(codes, cue, -1)
+    table['cue_file'] = _pick(files, cue, 'n/a')
+    table['cue_onset'] = _pick(onset, cue)
+
+    is_response = np.isin(types, list(RESPONSES.values())) & complete
+    for event, index in RESPONSES.items():
+        table[f'n_{event}'] = np.bincount(trial[(types == index) & complete], minlength=n_trials)
+    table['response_onset'] = _pick(onset, _first(trial, is_response, n_trials))
+    table['response_latency'] = table['response_onset'] - table['cue_onset']
+    table['response_offset'] = _pick(onset, _first(trial, is_response, n_trials, last=True))
+    table['feedback_onset'] = _pick(onset, feedback)
+    table['feedback_latency'] = table['feedback_onset'] - table['response_offset']
+
+    table['segment'] = _pick(segment, first_encoding, -1)
+    table = pd.DataFrame(table)[n_encoding > 0]
+    for column in ['sample', 'cue']:
+        table[column] = table[column].where(table[column] >= 0).astype('Int64')
+    return table.reset_index(drop=True)
+
+
+def _number(segment, beh_trials):
+    """
+    Helper function to number trials, see number_trials()
+    :param np.ndarray segment: Segment of the recording of every trial
+    :param list beh_trials: Trial numbers of the behavioral data, one array per start of the experiment
+    :return tuple: (run numbers, trial numbers, list of problems). Numbers are pandas Int64 arrays
+    """
+    run = pd.array([pd.NA] * len(segment), dtype='Int64')
+    trial = pd.array([pd.NA] * len(segment), dtype='Int64')
+    problems = []
+    n_segments = int(segment.max()) + 1 if len(segment) else 0
+    if beh_trials is None:
+        problems.append("behavioral data is missing, trials are not numbered")
+    elif len(beh_trials) > 1 and n_segments != len(beh_trials):
+        problems.append(f"{n_segments} EEG segment(s) do not match {len(beh_trials)} starts of the experiment, "
+                        f"trials are not numbered")
+    else:
+        part = segment if len(beh_trials) > 1 else np.zeros(len(segment), dtype=int)
+        for index, numbers in enumerate(beh_trials):
+            chosen = part == index
+            if len(beh_trials) > 1:
+                run[chosen] = index + 1
+            if chosen.sum() != len(numbers):
+                problems.append(f"part {index + 1}: {chosen.sum()} EEG trials, {len(numbers)} behavioral trials, "
+                                f"trials are not numbered")
+                continue
+            trial[chosen] = numbers
+    return run, trial, problems
+
+
+def number_trials(table, beh_trials):
+    """
+    Give trials the run and trial numbers of the behavioral data, which starts anew with every restart of the
+    experiment (see Subject.beh_segments()). Trials are assigned to the parts of the behavioral data by the segments of
+    the recording if there are as many segments as parts. With a single part, all segments belong to it (e.g. a
+    recording paused without restarting the experiment, sub-63). Trials of a part are only numbered if there are as many
+    of them as behavioral trials, otherwise their trial is n/a.
+    :param pd.DataFrame table: Trials, see split_trials(). Its segment column is replaced by run and trial
+    :param list beh_trials: Trial numbers of the behavioral data, one array per start of the experiment. None if the
+    behavioral data is missing
+    :return tuple: (trial table, list of problems). Trials which cannot be assigned to a part have n/a as run
+    """
+    run, trial, problems = _number(table.pop('segment').to_numpy(), beh_trials)
+    table.insert(2, 'run', run)
+    table.insert(3, 'trial', trial)
+    return table, problems
+
+
+def number_markers(samples, types, beh_trials, starts=(0,)):
+    """
+    Give every marker the run and trial numbers of its trial, the same ones as in the trial table (see split_trials()
+    and number_trials())
+    :param np.ndarray samples: Marker positions in samples
+    :param np.ndarray types: Event types of the markers (indices into subject.EVENT_TYPES)
+    :param list beh_trials: Trial numbers of the behavioral data, see number_trials()
+    :param starts: First samples of the segments of the recording, see Subject.eeg_segments()
+    :return tuple: (run numbers, trial numbers, list of problems). Numbers are pandas Int64 arrays with n/a for markers
+    of incomplete or not numbered trials
+    """
+    trial, complete, segment = assign_trials(types, samples, starts)
+    # Trials of the trial table: complete ones with encoding items
+    encoding = np.flatnonzero((types == ENCODING) & complete)
+    kept, first = np.unique(trial[encoding], return_index=True)
+    kept_run, kept_trial, problems = _number(segment[encoding[first]], beh_trials)
+
+    position = np.minimum(np.searchsorted(kept, trial), max(len(kept) - 1, 0))
+    found = kept[position] == trial if len(kept) else np.zeros(len(trial), dtype=bool)
+    run = pd.array([pd.NA] * len(trial), dtype='Int64')
+    number = pd.array([pd.NA] * len(trial), dtype='Int64')
+    run[found] = kept_run[position[found]]
+    number[found] = kept_trial[position[found]]
+    return run, number, problems
+
+
+def behavioral_trials(participant):
+    """
+    Read the trial numbers of the source behavioral data of a subject, see number_trials()
+    :param s.Subject participant: Subject to read
+    :return list: Trial numbers, one array per start of the experiment. None if the behavioral data is missing
+    """
+    try:
+        return [pd.to_numeric(segment['trial']).to_numpy() for segment in participant.beh_segments()]
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,244 @@
+"""
+Following code runs the conversion steps of source2bids.py as a task graph. Every task declares which files (or
+folders) it reads and writes, and the order between the tasks is derived from these declarations, so that independent
+work (e.g. copying stimuli and converting behavioral data) can overlap. This file is NECESSARY to successfully execute
+source2bids.py.
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os
+import os.path as op
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Task kinds. CPU-heavy tasks (e.g. MNE-BIDS conversion) run in separate processes, everything else in threads.
+CPU = 'cpu'
+IO = 'io'
+
+
+def file_size(*paths):
+    """
+    Helper function to sum up sizes of existing files, used for estimates of written data
+    :param str paths: Paths of files to measure. Missing files are ignored
+    :return int: Summed size in bytes
+    """
+    return sum(op.getsize(path) for path in paths if op.isfile(path))
+
+
+def tree_size(path):
+    """
+    Helper function to determine size of a complete folder (e.g. stimuli) before copying it
+    :param str path: Folder to measure
+    :return int: Summed size of all files in bytes
+    """
+    total = 0
+    for folder, _, files in os.walk(path):
+        total += file_size(*[op.join(folder, name) for name in files])
+    return total
+
+
+def human_size(size):
+    """
+    Helper function to print byte counts in a readable way
+    :param int size: Size in bytes, can be None if unknown
+    :return str: Size with a unit, e.g. 1.5 GB
+    """
+    if size is None:
+        return '?'
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
+def _timed(func, *args):
+    """
+    Helper function to run a task function and measure how long it took (in the worker process)
+    :return float: Duration in seconds
+    """
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+class Task:
+    """
+    Class represents a single step of the conversion, e.g. behavioral data of one subject or the README file.
+    """
+
+    def __init__(self, name, func, args=(), inputs=(), outputs=(), kind=IO, size=None, memory=None):
+        """
+        Construct Task class instance
+        :param str name: Unique name of the task, e.g. sub-01:beh
+        :param callable func: Function to call. Must be picklable for CPU tasks (module function or bound method)
+        :param tuple args: Positional arguments for the function
+        :param inputs: Files or folders the task reads. Paths relative to BIDS_ROOT if produced by another task
+        :param outputs: Files or folders the task writes, relative to BIDS_ROOT
+        :param str kind: CPU or IO, determines which worker pool runs the task
+        :param int size: Estimated number of bytes the task writes. None if unknown
+        :param int memory: Estimated peak memory of the task in bytes, see Pipeline.run(). None if unknown
+        """
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.kind = kind
+        self.size = size
+        self.memory = memory
+        self.depends = set()
+        # Filled in by Pipeline.run() once the task is done
+        self.duration = None
+
+    def __repr__(self):
+        return f'Task({self.name})'
+
+
+class Pipeline:
+    """
+    Class collects conversion tasks and runs them in dependency order with a limited number of parallel workers.
+
+    Dependencies are derived from declared files: a task depends on every task writing one of its inputs, and a task
+    writing the same file as a previously added task runs after it (so that the order of add() calls decides,
+    just as in a plain sequential script).
+    """
+
+    def __init__(self):
+        self.tasks = []
+
+    def add(self, name, func, *args, inputs=(), outputs=(), kind=IO, size=None, memory=None):
+        """
+        Add a task to the pipeline. See Task for description of parameters
+        :return Task: Created task
+        """
+        task = Task(name, func, args, inputs, outputs, kind, size, memory)
+        if any(other.name == name for other in self.tasks):
+            raise ValueError(f'Task {name} is defined twice')
+        self.tasks.append(task)
+        return task
+
+    def resolve(self):
+        """
+        Determine dependencies of all tasks from their declared inputs and outputs
+        :return list: Tasks grouped into levels; all tasks of a level can run at the same time
+        """
+        writers = {}
+        for task in self.tasks:
+            task.depends = set()
+            for output in task.outputs:
+                # Write after write: keep the order in which tasks have been added
+                task.depends.update(writers.get(output, []))
+            for output in task.outputs:
+                writers.setdefault(output, []).append(task)
+
+        for task in self.tasks:
+            for path in task.inputs:
+                task.depends.update(writer for writer in writers.get(path, []) if writer is not task)
+
+        # Group tasks into levels. If some tasks can never become ready, the declarations contain a cycle.
+        levels = []
+        done = set()
+        remaining = list(self.tasks)
+        while remaining:
+            level = [task for task in remaining if task.depends <= done]
+            if not level:
+                raise ValueError(f'Cyclic task dependencies: {remaining}')
+            levels.append(level)
+            done.update(level)
+            remaining = [task for task in remaining if task not in done]
+        return levels
+
+    def print_plan(self):
+        """
+        Print all tasks in execution order together with estimated amount of written data (dry run)
+        """
+        levels = self.resolve()
+        total = 0
+        unknown = 0
+        for number, level in enumerate(levels, start=1):
+            print(f'Level {number}:')
+            for task in level:
+                after = ', '.join(sorted(dependency.name for dependency in task.depends)) or '-'
+                memory = f'{human_size(task.memory)} RAM' if task.memory is not None else ''
+                print(f'    {task.name:<28} {task.kind:<4} {human_size(task.size):>10} {memory:>14}    after: {after}')
+                if task.size is None:
+                    unknown += 1
+                else:
+                    total += task.size
+        print(f'{len(self.tasks)} tasks in {len(levels)} levels, estimated {human_size(total)} to write', end='')
+        print(f' ({unknown} tasks of unknown size)' if unknown else '')
+
+    def run(self, cpu_jobs=1, io_jobs=1, dry_run=False, memory_budget=None):
+        """
+        Run all tasks as soon as their dependencies are done. Stops at the first failed task.
+
+        Ready CPU tasks are started largest (by estimated memory, then by estimated size) first, so that long recordings
+        do not end up running alone at the end. Tasks needing the same memory (e.g. plain copies of recordings, which
+        only need a worker) start with the largest recording. With a memory budget, a CPU task only starts if the
+        summed estimates of running CPU tasks stay within the budget; a task larger than the whole budget runs when no
+        other CPU task does.
+        :param int cpu_jobs: Maximal number of CPU tasks running at the same time (processes)
+        :param int io_jobs: Maximal number of IO tasks running at the same time (threads)
+        :param bool dry_run: Only print the plan, do not run anything
+        :param int memory_budget: Memory in bytes CPU tasks may use together. None for no limit
+        """
+        if dry_run:
+            self.print_plan()
+            return
+
+        self.resolve()
+        pending = list(self.tasks)
+        running = {}
+        done = set()
+        cpu_pool = ProcessPoolExecutor(max_workers=cpu_jobs)
+        io_pool = ThreadPoolExecutor(max_workers=io_jobs)
+        try:
+            while pending or running:
+                # Hand every ready IO task over to its pool, the pool itself limits how many of them run at once.
+                # CPU tasks are admitted here, within cpu_jobs and the memory budget.
+                ready = sorted((task for task in pending if task.depends <= done),
+                               key=lambda task: (task.memory or 0, task.size or 0), reverse=True)
+                cpu_running = [task for task in running.values() if task.kind == CPU]
+                used = sum(task.memory or 0 for task in cpu_running)
+                for task in ready:
+                    if task.kind == CPU:
+                        if len(cpu_running) >= cpu_jobs:
+                            continue
+                        if memory_budget and cpu_running and used + (task.memory or 0) > memory_budget:
+                            continue
+                        cpu_running.append(task)
+                        used += task.memory or 0
+                    pool = cpu_pool if task.kind == CPU else io_pool
+                    running[pool.submit(_timed, task.func, *task.args)] = task
+                    pending.remove(task)
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    try:
+                        task.duration = future.result()
+                    except Exception as error:
+                        raise RuntimeError(f'Task {task.name} failed') from error
+                    done.add(task)
+        finally:
+            # On failure, do not start anything that is still queued
+            cpu_pool.shutdown(cancel_futures=True)
+            io_pool.shutdown(cancel_futures=True)
@@ -0,0 +1,158 @@
+"""
+Following code checks EEG markers of all subjects for problems such as missing cues, interrupted recordings or
+markers in an impossible order, and collects the results into a single table, one row per subject:
+BIDS_ROOT/derivatives/qc/markers_qc.tsv
+
+Markers are read from the source .vmrk files (see brainvision.py), the recordings themselves are not loaded. Run from
+the BIDS_ROOT/code folder:
+
+python qc.py [--subjects 1,2,10-15]
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os
+import os.path as op
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import subject as s
+import markers as m
+import derivatives as d
+import source2bids
+
+# Default BIDS path.
+BIDS_ROOT = op.join(op.dirname(op.realpath(__file__)), "..")
+# Gaps between consecutive markers longer than this (seconds) are counted as pauses
+LONG_GAP = 60.0
+
+
+def check_markers(samples, types, sfreq, distractor, starts=(0,)):
+    """
+    Compute marker statistics of a single recording. Every trial is expected to contain two encoding items, each
+    followed by its position, a distractor (for the distractor task only), a retrocue, responses ending with UP and a
+    feedback. Trials are split as defined in markers.py.
+    :param np.ndarray samples: Marker positions in samples
+    :param np.ndarray types: Event types of the markers (indices into subject.EVENT_TYPES)
+    :param float sfreq: Sampling rate of the recording (Hz)
+    :param bool distractor: Whether the task contains distractors
+    :param starts: First samples of the segments of the recording, see Subject.eeg_segments()
+    :return dict: Statistics as a table row
+    """
+    row = {'n_markers': len(types)}
+    counts = np.bincount(types, minlength=len(s.EVENT_TYPES))
+    row.update({f'n_{event}': int(count) for event, count in zip(s.EVENT_TYPES, counts)})
+
+    # Incomplete trials (e.g. markers after the last feedback) are left out of per-trial checks
+    trial, complete, _ = m.assign_trials(types, samples, starts)
+    n_all = int(trial[-1]) + 1 if len(trial) else 0
+    closed = np.unique(trial[complete])
+    n_trials = len(closed)
+    row['n_trials'] = n_trials
+
+    def per_trial(mask):
+        return np.bincount(trial[mask & complete], minlength=n_all)[closed]
+
+    # Expected vs. observed number of markers per trial
+    expected = {m.ENCODING: m.ITEMS, m.POSITION: m.ITEMS, m.RETROCUE: 1, m.UP: 1, m.DISTRACTOR: 1 if distractor else 0}
+    for event, count in expected.items():
+        name = s.EVENT_TYPES[event]
+        observed = per_trial(types == event)
+        row[f'expected_{name}'] = count * n_trials
+        row[f'observed_{name}'] = int(observed.sum())
+        row[f'trials_wrong_{name}'] = int((observed != count).sum())
+
+    # Impossible orders: a position must directly follow an encoding item and vice versa, responses must come after
+    # the retrocue of the trial.
+    is_encoding = types == m.ENCODING
+    is_position = types == m.POSITION
+    previous_encoding = np.concatenate([[False], is_encoding[:-1]])
+    next_position = np.concatenate([is_position[1:], [False]])
+    row['position_without_encoding'] = int((is_position & ~previous_encoding).sum())
+    row['encoding_without_position'] = int((is_encoding & ~next_position).sum())
+
+    index = np.arange(len(types))
+    first_cue = np.full(n_all, len(types))
+    first_response = first_cue.copy()
+    cue_mask = (types == m.RETROCUE) & complete
+    response_mask = np.isin(types, list(m.RESPONSES.values())) & complete
+    np.minimum.at(first_cue, trial[cue_mask], index[cue_mask])
+    np.minimum.at(first_response, trial[response_mask], index[response_mask])
+    row['response_before_retrocue'] = int((first_response < first_cue)[closed].sum())
+
+    # Gaps between consecutive markers
+    gaps = np.diff(samples) / sfreq
+    row['gap_min'] = round(float(gaps.min()), 4) if len(gaps) else np.nan
+    row['gap_median'] = round(float(np.median(gaps)), 4) if len(gaps) else np.nan
+    row['gap_max'] = round(float(gaps.max()), 4) if len(gaps) else np.nan
+    row['n_long_gaps'] = int((gaps > LONG_GAP).sum())
+    row['n_simultaneous'] = int((gaps == 0).sum())
+    return row
+
+
+def subject_qc(participant):
+    """
+    Compute marker statistics of a single subject
+    :param s.Subject participant: Subject to check
+    :return dict: Statistics as a table row
+    """
+    row = {'participant_id': f'sub-{participant.id}', 'task': participant.task}
+    try:
+        header = participant.header()
+        samples, _, types = participant.triggers()
+        starts = [start for start, _ in participant.eeg_segments()]
+    except FileNotFoundError as error:
+        # E.g. sub-20, whose EEG data has not been recorded
+        row['problem'] = f'EEG data missing: {op.basename(error.filename or "")}'
+        return row
+    row.update(check_markers(samples, types, header['sfreq'], bool(participant.distractors), starts))
+    return row
+
+
+def run(participants, bids_root=BIDS_ROOT, jobs=os.cpu_count()):
+    """
+    Check markers of all subjects in parallel and write the results into BIDS_ROOT/derivatives/qc/markers_qc.tsv
+    :param list participants: Subject class instances to check
+    :param str bids_root: Location of the dataset
+    :param int jobs: Number of parallel processes
+    :return pd.DataFrame: QC table, one row per subject
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        table = pd.DataFrame(list(pool.map(subject_qc, participants)))
+
+    d.make_description(d.QC, bids_root)
+    table.to_csv(op.join(d.derivatives_root(d.QC, bids_root), 'markers_qc.tsv'), index=False, na_rep='n/a',
+                 sep='\t')
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check EEG markers of MemorEEG subjects.')
+    parser.add_argument('--subjects', type=source2bids.parse_subjects,
+                        help='Check only the given subjects, e.g. 1,2,10-15.')
+    args = parser.parse_args()
+
+    participants = source2bids.read_participants(source2bids.select_subjects(args.subjects))
+    table = run(participants, source2bids.BIDS_ROOT)
+    print(table.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Following code keeps the original, plain implementations of the subject conversion: the recording is written as a
+whole, events are decoded row by row and behavioral data is cleaned in a single pass. The conversion script itself
+uses faster implementations of the same steps (see subject.py, e.g. Subject.decode_events()), these ones serve as the
+reference code path of golden.py, so that the results of both can be compared on a fixture dataset.
+
+Metadata definitions (textfiles.py) and the dataset-level files are shared with the conversion script, only the way
+subject data is processed differs.
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import json
+import shutil
+import mne
+import pandas as pd
+import textfiles
+import subject as s
+from mne_bids import BIDSPath, write_raw_bids
+
+
+def eeg_to_bids(participant, bids_root=s.BIDS_ROOT):
+    """
+    Expand the collected BrainVision data into BIDS-compliant structure, decoding events row by row
+    :param s.Subject participant: Subject to convert. Its source data has to be a plain folder, not an archive
+    :param str bids_root: New location of the data
+    """
+    # First, let's find and read the source EEG data
+    raw = mne.io.read_raw_brainvision(participant.vhdr_path)
+
+    # Add known metadata
+    raw = raw.set_channel_types(s.CHANNEL_TYPES)
+    raw.info["line_freq"] = 50
+
+    # Use mne-bids to expand the existing data
+    bids_path = BIDSPath(subject=participant.id, task=participant.task, root=bids_root)
+    write_raw_bids(raw, bids_path, overwrite=True)
+
+    # Cleaning auto-generated events.tsv from mne-bids
+
+    # Second, let's find where the auto-generated _events.tsv file is.
+    events_path = BIDSPath(subject=participant.id, task=participant.task, root=bids_root, datatype='eeg',
+                           suffix='events', extension=".tsv")
+    events = pd.read_csv(events_path, sep="\t")
+
+    # I'll rename one column for a cleaner look
+    events.rename(columns={'trial_type': 'trial'}, inplace=True)
+
+    # We only want stimuli, so filter the dataset so that it only contains stimulus rows
+    events = events[events.trial.str.match(r'Stimulus/S...')]
+
+    # Fill in new columns according to information coded in stimulus ID:
+    # Take the last 3 symbols of event comments and transform them to event codes
+    events['trial'] = events['trial'].transform(lambda string: int(string[-3:]))
+    # Define event type using event code
+    events['event'] = events['trial'].transform(lambda stimulus: participant.get_event_type(stimulus))
+    # Determine stimulus file using event code
+    events['stim_file'] = events['trial'].transform(lambda stimulus: participant.get_stim_file(stimulus))
+    # Add object rotation if exists
+    events['rotation'] = events['trial'].transform(
+        lambda stimulus: 'n/a' if (stimulus > 156) else (stimulus % 20 - 1) * 22.5 + 11.25)
+    # Add object position if exists
+    events['position'] = events['trial'].transform(
+        lambda stimulus: (stimulus % 200 - 1) * 22.5 + 11.25 if (201 <= stimulus <= 216) else 'n/a')
+
+    # Every object position is marked as a separate event RIGHT AFTER the event encoding an object and its
+    # rotation. We use this to couple an object and its position, so that one row represents one real event.
+    # Then we clean the table from unnecessary position-only rows.
+    for index, event in events.iterrows():
+        if event['event'] == 'position':
+            events.at[index - 1, 'position'] = event['position']
+
+    events = events[events.event != 'position']
+
+    # Let's write the new dataframe to _events.tsv
+    events[['onset', 'duration', 'trial', 'sample', 'stim_file', 'event', 'rotation', 'position']].to_csv(
+        events_path, index=False, na_rep="n/a", sep="\t")
+
+    # Next, let's add a JSON sidecar with description of *_events.tsv data
+    json_path = BIDSPath(subject=participant.id, task=participant.task, root=bids_root, datatype='eeg',
+                         suffix='events', extension=".json")
+    textfiles.write(textfiles.eeg_events(), json_path)
+
+    # Last, let's update the auto-generated metadata with available information.
+    json_path = BIDSPath(subject=participant.id, task=participant.task, root=bids_root, datatype='eeg', suffix='eeg',
+                         extension=".json")
+    with open(json_path, 'r+') as data:
+        eeg_json = textfiles.eeg_sidecar(json.load(data))
+        data.seek(0)
+        json.dump(eeg_json, data, ensure_ascii=False, indent=4)
+        data.truncate()
+
+
+def beh_to_bids(participant, bids_root=s.BIDS_ROOT):
+    """
+    Copy behavioral data of a subject to a new BIDS-compatible location and drop redundant/empty columns
+    :param s.Subject participant: Subject to convert. Its source data has to be a plain folder, not an archive
+    :param str bids_root: New location of the data
+    """
+    # First, copy the initial behavioral data file into a BIDS-compatible folder
+    bids_path = BIDSPath(subject=participant.id, task=participant.task, root=bids_root, datatype='beh', suffix="beh",
+                         extension=".tsv").mkdir()
+    shutil.copy(participant.beh_path, bids_path)
+
+    # Drop redundant and empty columns
+    beh_data = pd.read_csv(bids_path, sep='\t')
+
+    # It is not enough to just use any number of whitespaces as delimiter. One edge case supposes that the
+    # participant has neither changed the object, nor the orientation (e.g. the correct object has spawned in the
+    # correct orientation). This means some data will be filled with whitespaces, and this causes data shift for
+    # some trials when using delim_whitespace=True. So I'm stripping the whitespaces semi-manually.
+    beh_data = beh_data.applymap(lambda x: str(x).replace(" ", ""))
+    beh_data.columns = beh_data.columns.str.replace(" ", "")
+
+    # Drop duplicate header rows (needs to happen before checking for empty cells!)
+    beh_data = beh_data[beh_data.iloc[:, 0] != beh_data.columns[0]]
+
+    # Drop first duplicate trials if restarted the experiment
+    beh_data.drop_duplicates(subset=['trial'], keep='last', inplace=True)
+
+    # Columns to drop
+    empty_cols = [col for col in beh_data.columns if
+                  (beh_data[col].isnull().all() or beh_data[col].eq("NaN").all())]
+
+    # Some columns already carry information from participants.tsv (e.g. age, gender...). Other columns do
+    # not carry any relevant information and have been inherited through adjusting the script from previous
+    # experiments.
+    redundant_cols = ['task_version', 'date', 'subID', 'sub_gender', 'sub_age', 'practice', 'righthanded',
+                      'colorset_pins', 'type_of_task', 'type_of_ings', 'position_odd_pings', 'object_test_name',
+                      'block_repe_null', 'distractors']
+
+    # For tasks without distractor, the would-be distractor values are still recorded. They do not carry
+    # any valuable information and can be removed.
+    if not participant.distractors:
+        redundant_cols += ['distractor_name', 'distractor_id', 'distractor_rot', 'onset_distractor']
+
+    beh_data.drop(empty_cols + redundant_cols, axis=1, inplace=True)
+
+    # Correct typo in column name
+    beh_data.rename(columns={'object_2_ID': 'object_2_id'}, inplace=True)
+
+    # Fill empty values
+    beh_data.fillna("n/a", inplace=True)  # for true n/a
+    beh_data = beh_data.replace("NaN", "n/a", regex=True)  # for NaN as strings
+    beh_data = beh_data.replace("", "n/a", regex=True)  # for empty cells
+
+    # Write cleared dataset into sub-<ID>_task-<taskname>_beh.tsv file
+    beh_data.to_csv(bids_path, sep='\t', index=False)
+
+    # Create an accompanying JSON sidecar with data description
+    json_path = BIDSPath(subject=participant.id, task=participant.task, root=bids_root, datatype="beh", suffix="beh",
+                         extension=".json")
+    textfiles.write(textfiles.behavioral(participant.task), json_path)
@@ -0,0 +1,153 @@
+"""
+Following code applies the current metadata definitions (textfiles.py, subject.py) to sidecars of an already converted
+dataset in place: *_eeg.json, *_events.json, *_beh.json and the channel types in *_channels.tsv of every subject.
+EEG data and other files are not touched, so a metadata fix does not need the whole conversion to run again.
+
+Sidecars deduplicated through BIDS inheritance (see inheritance.py) are updated as seen by a BIDS reader and
+deduplicated again afterwards. Files whose content actually changed are listed. Run from the BIDS_ROOT/code folder:
+
+python refresh.py
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os.path as op
+import glob
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import textfiles
+import inheritance
+import subject as s
+
+# Default BIDS path.
+BIDS_ROOT = op.join(op.dirname(op.realpath(__file__)), "..")
+# Number of files processed at the same time. Sidecars are small, so this is about file system latency.
+JOBS = 16
+
+
+def current_sidecar(contents, task, suffix):
+    """
+    Apply current metadata definitions to a JSON sidecar, the same way the conversion writes it
+    :param dict contents: Sidecar contents as seen by a BIDS reader
+    :param str task: Task name, e.g. distractor
+    :param str suffix: Sidecar suffix: eeg, events or beh
+    :return dict: Updated contents
+    """
+    if suffix == "eeg":
+        return textfiles.eeg_sidecar(contents)
+    if suffix == "events":
+        return textfiles.eeg_events()
+    return textfiles.behavioral(task)
+
+
+def refresh_sidecar(path, bids_root, task, suffix):
+    """
+    Update a subject JSON sidecar. If the update changes what a BIDS reader sees, the full sidecar is written; it is
+    deduplicated again afterwards.
+    :param str path: Path of the subject sidecar (does not need to exist if all content is inherited)
+    :param str bids_root: Location of the dataset
+    :param str task: Task name, e.g. distractor
+    :param str suffix: Sidecar suffix: eeg, events or beh
+    :return bool: True if the sidecar has been written
+    """
+    contents = inheritance.effective(path, bids_root, task, suffix)
+    updated = current_sidecar(contents, task, suffix)
+    if updated == contents:
+        return False
+    textfiles.write(updated, path)
+    return True
+
+
+def refresh_channels(path):
+    """
+    Update channel types in a channels.tsv file, see subject.CHANNEL_TYPES
+    :param str path: Path of the channels.tsv file
+    :return bool: True if the file has been written
+    """
+    channels = pd.read_csv(path, sep="\t", dtype=str, keep_default_na=False)
+    types = channels["name"].map({name: kind.upper() for name, kind in s.CHANNEL_TYPES.items()})
+    updated = types.fillna(channels["type"])
+    if updated.equals(channels["type"]):
+        return False
+    channels["type"] = updated
+    channels.to_csv(path, index=False, sep="\t")
+    return True
+
+
+def _snapshot(paths):
+    """
+    Helper function to remember contents of files, to see later which of them changed
+    :return dict: Paths mapped to contents (None for missing files)
+    """
+    contents = {}
+    for path in paths:
+        if op.exists(path):
+            with open(path, "rb") as data:
+                contents[path] = data.read()
+        else:
+            contents[path] = None
+    return contents
+
+
+def run(bids_root=BIDS_ROOT, jobs=JOBS):
+    """
+    Refresh sidecars of all subjects in parallel
+    :param str bids_root: Location of the dataset
+    :param int jobs: Number of files processed at the same time
+    :return list: Paths of files whose content changed (written, created or removed)
+    """
+    sidecars = [(path, task, datatype, suffix) for task in inheritance.TASKS
+                for datatype, suffix in inheritance.SIDECARS
+                for path in inheritance.subject_paths(bids_root, task, datatype, suffix)]
+    channels = sorted(glob.glob(op.join(bids_root, "sub-*", "eeg", "sub-*_channels.tsv")))
+    roots = [inheritance.root_path(bids_root, task, suffix) for task in inheritance.TASKS
+             for _, suffix in inheritance.SIDECARS]
+    before = _snapshot([path for path, *_ in sidecars] + channels + roots)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        written = list(pool.map(lambda sidecar: refresh_sidecar(sidecar[0], bids_root, sidecar[1], sidecar[3]),
+                                sidecars))
+        list(pool.map(refresh_channels, channels))
+
+    # Deduplicate again where the dataset uses inheritance and something has been written
+    for task in inheritance.TASKS:
+        for datatype, suffix in inheritance.SIDECARS:
+            touched = any(done and (sidecar[1], sidecar[3]) == (task, suffix)
+                          for sidecar, done in zip(sidecars, written))
+            if touched and op.exists(inheritance.root_path(bids_root, task, suffix)):
+                inheritance.deduplicate(bids_root, task, datatype, suffix)
+
+    after = _snapshot(before)
+    return sorted(path for path in before if before[path] != after[path])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply current metadata definitions to sidecars of the dataset.')
+    parser.add_argument('--jobs', type=int, default=JOBS, help='Number of files processed at the same time.')
+    args = parser.parse_args()
+
+    changed = run(BIDS_ROOT, args.jobs)
+    for path in changed:
+        print(op.relpath(path, BIDS_ROOT))
+    print(f'{len(changed)} file(s) changed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""
+Following code screens signal quality of every EEG channel before release: flat and saturated channels, amplitude
+range and power line noise. The BrainVision binary data is memory-mapped and processed in chunks, so memory use does
+not depend on the length of a recording. Results are written per subject into BIDS_ROOT/derivatives/qc:
+- *_desc-screening_channels.tsv: statistics and suggested status (good/bad) of every channel
+- *_desc-screening_psd.tsv: Welch power spectral density of every channel
+
+Run from the BIDS_ROOT/code folder:
+
+python screening.py [--subjects 1,2,10-15] [--apply]
+
+With --apply, suggested statuses are copied into channels.tsv of converted subjects.
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os
+import os.path as op
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from mne_bids import BIDSPath, get_bids_path_from_fname
+import brainvision
+import derivatives as d
+import source2bids
+
+# Default BIDS path.
+BIDS_ROOT = op.join(op.dirname(op.realpath(__file__)), "..")
+# Power line frequency (Hz), the same as line_freq in Subject.raw_to_bids()
+LINE_FREQ = 50.0
+# Length of Welch segments (seconds), determines frequency resolution of the spectra
+WELCH_SECONDS = 2.0
+# Number of Welch segments read from disk at once. Together with the number of channels, this is what bounds memory.
+CHUNK_SEGMENTS = 64
+
+# Limits for suggesting a channel as bad
+FLAT_FRACTION = 0.5  # share of samples equal to the previous one
+SATURATED_FRACTION = 0.01  # share of samples at the limits of the amplifier (or of the recorded data type)
+MIN_STD = 0.5  # µV, standard deviation of an intact channel is far above that
+LINE_NOISE_DB = 20.0  # power at LINE_FREQ relative to neighbouring frequencies
+
+
+def screen_recording(header):
+    """
+    Compute per-channel statistics and Welch spectra of a recording, reading it chunk by chunk
+    :param dict header: Recording parameters, see brainvision.read_header()
+    :return tuple: (statistics dataframe, one row per channel; frequencies; power spectral densities in µV²/Hz,
+    shape (channels, frequencies))
+    """
+    data = brainvision.memmap(header)
+    n_samples, n_channels = data.shape
+    resolution = np.array([channel[1] for channel in header["channels"]])
+    dtype = data.dtype
+    limits = (np.iinfo(dtype).min, np.iinfo(dtype).max) if dtype.kind == "i" else (-np.inf, np.inf)
+
+    # Welch: Hann-windowed segments with 50 % overlap. Chunks overlap by half a segment, so no segment is lost.
+    nperseg = min(int(WELCH_SECONDS * header["sfreq"]), n_samples)
+    step = nperseg // 2
+    window = np.hanning(nperseg)
+    chunk = CHUNK_SEGMENTS * step
+
+    minimum = np.full(n_channels, np.inf)
+    maximum = np.full(n_channels, -np.inf)
+    total = np.zeros(n_channels)
+    squares = np.zeros(n_channels)
+    flat = np.zeros(n_channels)
+    saturated = np.zeros(n_channels)
+    power = np.zeros((n_channels, nperseg // 2 + 1))
+    n_segments = 0
+    previous = None
+
+    for start in range(0, n_samples, chunk):
+        raw = np.asarray(data[start:start + chunk])
+        values = raw * resolution
+
+        minimum = np.minimum(minimum, values.min(axis=0))
+        maximum = np.maximum(maximum, values.max(axis=0))
+        total += values.sum(axis=0)
+        squares += (values ** 2).sum(axis=0)
+        saturated += ((raw <= limits[0]) | (raw >= limits[1])).sum(axis=0)
+        flat += (np.diff(raw, axis=0) == 0).sum(axis=0)
+        if previous is not None:
+            flat += raw[0] == previous
+        previous = raw[-1]
+
+        # Segments starting in this chunk; the last ones reach into the next chunk
+        starts = np.arange(start, min(start + chunk, n_samples - nperseg + 1), step)
+        if len(starts):
+            segments = np.asarray(data[starts[0]:starts[-1] + nperseg]) * resolution
+            index = (starts - starts[0])[:, None] + np.arange(nperseg)
+            # Shape (segments, samples, channels) -> detrend (remove mean) and window every segment
+            windowed = segments[index]
+            windowed = (windowed - windowed.mean(axis=1, keepdims=True)) * window[None, :, None]
+            power += (np.abs(np.fft.rfft(windowed, axis=1)) ** 2).sum(axis=0).T
+            n_segments += len(starts)
+
+    # One-sided power spectral density
+    freqs = np.fft.rfftfreq(nperseg, 1 / header["sfreq"])
+    psd = power / max(n_segments, 1) / (header["sfreq"] * (window ** 2).sum())
+    psd[:, 1:-1] *= 2
+
+    mean = total / n_samples
+    std = np.sqrt(np.maximum(squares / n_samples - mean ** 2, 0))
+    line = (freqs >= LINE_FREQ - 1) & (freqs <= LINE_FREQ + 1)
+    around = (np.abs(freqs - LINE_FREQ) > 1) & (np.abs(freqs - LINE_FREQ) <= 5)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        line_noise = 10 * np.log10(psd[:, line].mean(axis=1) / psd[:, around].mean(axis=1))
+
+    stats = pd.DataFrame({
+        "name": [channel[0] for channel in header["channels"]],
+        "min": minimum.round(2),
+        "max": maximum.round(2),
+        "range": (maximum - minimum).round(2),
+        "mean": mean.round(2),
+        "std": std.round(2),
+        "flat_fraction": (flat / max(n_samples - 1, 1)).round(4),
+        "saturated_fraction": (saturated / n_samples).round(4),
+        "line_noise_db": line_noise.round(2),
+    })
+    return stats, freqs, psd
+
+
+def suggest_status(stats):
+    """
+    Suggest channel status from channel statistics, in the format of BIDS channels.tsv
+    :param pd.DataFrame stats: Statistics, see screen_recording()
+    :return pd.DataFrame: Statistics with additional status and status_description columns
+    """
+    reasons = pd.DataFrame({
+        f"flat (>{FLAT_FRACTION:.0%} repeated samples)": stats.flat_fraction > FLAT_FRACTION,
+        f"flat (std < {MIN_STD} µV)": stats["std"] < MIN_STD,
+        f"saturated (>{SATURATED_FRACTION:.0%} samples at limits)": stats.saturated_fraction > SATURATED_FRACTION,
+        f"line noise (>{LINE_NOISE_DB:.0f} dB at {LINE_FREQ:.0f} Hz)": stats.line_noise_db > LINE_NOISE_DB,
+    })
+    stats = stats.copy()
+    stats["status"] = np.where(reasons.any(axis=1), "bad", "good")
+    stats["status_description"] = reasons.apply(lambda row: "; ".join(row.index[row]) or "n/a", axis=1)
+    return stats
+
+
+def screening_path(participant, suffix, bids_root=BIDS_ROOT):
+    """
+    Helper function to determine location of screening results of a subject
+    :param subject.Subject participant: Screened subject
+    :param str suffix: channels or psd
+    :param str bids_root: Location of the dataset
+    :return BIDSPath: Path of the file
+    """
+    return BIDSPath(subject=participant.id, task=participant.task, root=d.derivatives_root(d.QC, bids_root),
+                    datatype="eeg", suffix=suffix, description="screening", extension=".tsv", check=False)
+
+
+def screen_subject(participant, bids_root=BIDS_ROOT):
+    """
+    Screen source EEG data of a subject and write results into BIDS_ROOT/derivatives/qc
+    :param subject.Subject participant: Subject to screen
+    :param str bids_root: Location of the dataset
+    :return int: Number of channels suggested as bad, None if the subject has no EEG data
+    """
+    try:
+        header = participant.header()
+        # Source data kept in an archive is extracted for memory mapping
+        participant.source.ensure(header["data_file"])
+    except FileNotFoundError:
+        # E.g. sub-20, whose EEG data has not been recorded
+        return None
+    stats, freqs, psd = screen_recording(header)
+    stats = suggest_status(stats)
+
+    channels_path = screening_path(participant, "channels", bids_root)
+    channels_path.mkdir()
+    stats.to_csv(channels_path.fpath, index=False, na_rep="n/a", sep="\t")
+
+    spectra = pd.DataFrame(psd.T, columns=stats.name)
+    spectra.insert(0, "frequency", freqs)
+    spectra.to_csv(screening_path(participant, "psd", bids_root).fpath, index=False, float_format="%.6g", sep="\t")
+    return int((stats.status == "bad").sum())
+
+
+def apply_status(participant, bids_root=BIDS_ROOT):
+    """
+    Copy suggested channel statuses into channels.tsv of a converted subject. The whole source recording is screened,
+    so a subject split into runs (source2bids.py --runs) gets the same statuses in channels.tsv of every run.
+    :param subject.Subject participant: Screened subject
+    :param str bids_root: Location of the dataset
+    """
+    suggested = pd.read_csv(screening_path(participant, "channels", bids_root).fpath, sep="\t", keep_default_na=False)
+    status = suggested.set_index("name")
+    # Recordings of the subject (one per run) are listed in its *_scans.tsv
+    sub = f"sub-{participant.id}"
+    scans = pd.read_csv(op.join(bids_root, sub, f"{sub}_scans.tsv"), sep="\t")
+    for filename in scans.filename[scans.filename.str.startswith("eeg/")]:
+        channels_path = get_bids_path_from_fname(op.join(bids_root, sub, filename)).update(suffix="channels",
+                                                                                             extension=".tsv")
+        channels = pd.read_csv(channels_path.fpath, sep="\t", keep_default_na=False)
+        channels["status"] = channels["name"].map(status["status"]).fillna("good")
+        channels["status_description"] = channels["name"].map(status["status_description"]).fillna("n/a")
+        channels.to_csv(channels_path.fpath, index=False, na_rep="n/a", sep="\t")
+
+
+def run(participants, bids_root=BIDS_ROOT, jobs=os.cpu_count(), apply=False):
+    """
+    Screen all subjects in parallel, one subject per process
+    :param list participants: Subject class instances to screen
+    :param str bids_root: Location of the dataset
+    :param int jobs: Number of parallel processes
+    :param bool apply: Copy suggested statuses into channels.tsv of converted subjects
+    :return dict: Subject folder names mapped to number of channels suggested as bad
+    """
+    d.make_description(d.QC, bids_root)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        bad = dict(zip([f"sub-{participant.id}" for participant in participants],
+                       pool.map(screen_subject, participants, [bids_root] * len(participants))))
+    if apply:
+        for participant in participants:
+            if bad[f"sub-{participant.id}"] is not None and op.isdir(op.join(bids_root, f"sub-{participant.id}")):
+                apply_status(participant, bids_root)
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Screen signal quality of MemorEEG EEG channels.')
+    parser.add_argument('--subjects', type=source2bids.parse_subjects,
+                        help='Screen only the given subjects, e.g. 1,2,10-15.')
+    parser.add_argument('--apply', action='store_true',
+                        help='Copy suggested channel statuses into channels.tsv of converted subjects.')
+    args = parser.parse_args()
+
+    participants = source2bids.read_participants(source2bids.select_subjects(args.subjects))
+    for sub, bad in run(participants, source2bids.BIDS_ROOT, apply=args.apply).items():
+        print(f'{sub}: ' + ('EEG data missing' if bad is None else f'{bad} channel(s) suggested as bad'))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,7 @@ Required dependencies:
 - mne <= 1.2.0
 - mne-bids <= 0.11
 
-The script (and two "subscripts" belonging to it, subject.py and textfiles.py) is intended to run from the
+The script (and "subscripts" belonging to it, e.g. subject.py and textfiles.py) is intended to run from the
 BIDS_ROOT/code folder and expects following folder/data structure:
 
 BIDS_ROOT
@@ -16,6 +16,24 @@ BIDS_ROOT
 │   └── source2bids.py
 │   └── subject.py
 │   └── textfiles.py
+│   └── pipeline.py
+│   └── staging.py
+│   └── derivatives.py
+│   └── brainvision.py
+│   └── qc.py
+│   └── screening.py
+│   └── inheritance.py
+│   └── manifest.py
+│   └── watch.py
+│   └── dataset.py
+│   └── golden.py
+│   └── refresh.py
+│   └── backend.py
+│   └── sources.py
+│   └── trials.py
+│   └── markers.py
+│   └── reference.py
+│   └── fixtures
 └── sourcedata
 │   ├── behavioral
 │   │   ├── resultfile_p001.txt
@@ -52,11 +70,22 @@ SOFTWARE.
 # Import necessary packages
 import os
 import os.path as op
+import glob
+import socket
+import argparse
+import io
+from datetime import datetime
 from distutils.dir_util import copy_tree
 import pandas as pd
 import urllib3
 import textfiles
 import subject as s
+import pipeline as p
+import staging
+import derivatives as d
+import inheritance
+import backend
+import sources
 
 # Create constants for easier use
 # Which or how many participants should be converted by MNE-BIDS? (future ID sequence)
@@ -67,6 +96,37 @@ UPDATE_TEXT_ONLY = False
 BIDS_ROOT = op.join(op.dirname(op.realpath(__file__)), "..")
 # Default source data root
 DATA_PATH = op.join(op.dirname(op.realpath(__file__)), "../sourcedata")
+# How many CPU-heavy (EEG conversion) and IO-heavy (copying, text files) tasks may run at the same time?
+CPU_JOBS = os.cpu_count()
+IO_JOBS = 8
+# How much memory may CPU-heavy tasks use together (bytes)? Their peak memory is estimated from recording sizes, see
+# Subject.memory(). Default: 80 % of physical memory (None: no limit).
+try:
+    MEMORY_BUDGET = int(0.8 * os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+except (AttributeError, ValueError, OSError):
+    MEMORY_BUDGET = None
+# Should the conversion plan only be printed (with estimated amount of data to write) instead of running it?
+DRY_RUN = False
+# Should subjects already published by an interrupted run be skipped? If False, all subjects are converted anew.
+RESUME = True
+# Folder for per-subject results of (possibly sharded) runs: participants.tsv rows and run reports. These are merged
+# into dataset-level files afterwards, so that runs on different machines never write the same file.
+FRAGMENTS = op.join(BIDS_ROOT, ".fragments")
+# Should JSON sidecars shared by all subjects of a task be written once at the dataset root (BIDS inheritance)? Off by
+# default: MNE-BIDS readers (e.g. read_raw_bids() in dataset.py and derivatives.py) only read subject sidecars, keys
+# they need stay there either way (see inheritance.SUBJECT_KEYS).
+INHERIT_SIDECARS = False
+# Should preprocessed EEG derivatives (filtered and resampled, see derivatives.py) be computed as well?
+DERIVATIVES = False
+# Should EEG epochs around encoding, distractor and retrocue events be cached (see derivatives.py)?
+EPOCHS = False
+# Should interrupted recordings (New Segment markers) and restarted experiments be written as separate runs (run-1,
+# run-2...)? If False, every recording is written as a whole and trials repeated after a restart are dropped. Cannot
+# be combined with DERIVATIVES or EPOCHS, derivatives expect a recording as a single file.
+SPLIT_RUNS = False
+# Where should the dataset be uploaded while it is converted (s3://bucket/prefix or a folder, see backend.py)? None for
+# no upload.
+UPLOAD = None
 
 
 # make_ functions contain very similar code to generate text annotations.
@@ -107,8 +167,8 @@ def make_readme():
     with open(filename, "w") as fout:
         fout.write(textfiles.readme())
 
-    # Remove automatically generated README (from mne-bids, so will be only generated if subject data is updated)
-    if not UPDATE_TEXT_ONLY:
+    # Remove automatically generated README (from mne-bids, datasets converted before staging still have it)
+    if op.exists(op.join(BIDS_ROOT, "README")):
         os.remove(op.join(BIDS_ROOT, "README"))
 
 
@@ -151,11 +211,108 @@ def make_bids_validator_config():
     textfiles.write(bids_validator_config_json, filename)
 
 
-def main():
-    # Main idea is: process the participants_log.tsv line by line and transform accompanying subject data.
+def make_participants():
+    """
+    Create participants.tsv out of participant fragments of all (sharded) runs, overwriting the one generated by
+    MNE-BIDS.
+    """
+    # Create an empty dataframe with assigned column names as basis for future participants.tsv.
+    participants = pd.DataFrame(columns=['participant_id',
+                                         'age',
+                                         'hand',
+                                         'sex',
+                                         'stimuli_set',
+                                         'distractor',
+                                         'distractor_set'])
+
+    # Append participant info to future participants.tsv, one fragment - one row.
+    fragments = sorted(glob.glob(op.join(FRAGMENTS, "participants", "sub-*.tsv")))
+    participants = pd.concat([participants] + [pd.read_csv(fragment, sep="\t", dtype=str, keep_default_na=False)
+                                               for fragment in fragments], ignore_index=True)
+
+    # Fill empty places in the dataset and overwrite generated participants.tsv from MNE-BIDS with newly created one.
+    participants.fillna('n/a', inplace=True)
+    filename = op.join(BIDS_ROOT, "participants.tsv")
+    participants.to_csv(filename, index=False, na_rep="n/a", sep="\t")
+
+
+def make_participant_fragment(participant):
+    """
+    Write the participants.tsv row of a single subject into the fragments folder.
+    :param s.Subject participant: Subject to write the row for
+    """
+    filename = op.join(FRAGMENTS, "participants", f"sub-{participant.id}.tsv")
+    os.makedirs(op.dirname(filename), exist_ok=True)
+    pd.DataFrame([participant.data()]).to_csv(filename, index=False, na_rep="n/a", sep="\t")
+
+
+def make_report(participant, shard, tasks, note=None):
+    """
+    Write a run report of a single subject into the fragments folder: where, when and how fast it was converted.
+    :param s.Subject participant: Converted subject
+    :param str shard: Shard of the run, e.g. 3/10 (None if not sharded)
+    :param list tasks: Finished pipeline tasks of the subject
+    :param str note: Why the data has not been split into runs, see Subject.runs(). None if there is nothing to tell
+    """
+    report = {
+        "participant_id": f"sub-{participant.id}",
+        "task": participant.task,
+        "host": socket.gethostname(),
+        "shard": shard,
+        "finished": datetime.now().isoformat(timespec="seconds"),
+        "durations": {task.name: round(task.duration, 3) for task in tasks if task.duration is not None},
+        "note": note,
+    }
+    filename = op.join(FRAGMENTS, "reports", f"sub-{participant.id}.json")
+    os.makedirs(op.dirname(filename), exist_ok=True)
+    textfiles.write(report, filename)
+
+
+def make_stimuli():
+    """
+    Copy stimuli folder from sourcedata.
+    """
+    copy_tree(op.join(DATA_PATH, "stimuli"), op.join(BIDS_ROOT, "stimuli"))
+
+
+def upload_dataset(uploader):
+    """
+    Upload the dataset. Stored files without a local counterpart (e.g. subject sidecars moved to the dataset level by
+    inheritance) are deleted for every published subject, including subjects published by earlier or other (sharded)
+    runs, which a --merge run converts none of.
+    :param backend.Uploader uploader: Uploader to publish the dataset with
+    :return tuple: Numbers of uploaded, skipped and deleted files
+    """
+    subs = sorted(op.basename(path) for path in glob.glob(op.join(BIDS_ROOT, "sub-*")) if op.isdir(path))
+    return uploader.sync(None, subs)
+
+
+def select_subjects(subjects=None, shard=None):
+    """
+    Determine subject IDs to convert in this run.
+    :param list subjects: Explicitly chosen subject IDs. If None, SUBJECTS are used
+    :param tuple shard: Shard as (index, count), index from 1 to count. Every shard gets every count-th subject
+    :return list: Subject IDs
+    """
+    # Data for sub-49 not collected (see README/Missing data)
+    sub_ids = [sub_id for sub_id in (subjects or SUBJECTS) if sub_id != 49]
+    if shard:
+        index, count = shard
+        sub_ids = sub_ids[index - 1::count]
+    return sub_ids
+
 
+def read_participants(sub_ids, data_path=DATA_PATH):
+    """
+    Read participants_log.tsv and create a Subject class instance for every chosen subject.
+    :param list sub_ids: Numerical subject IDs
+    :param str data_path: Root folder with source data
+    :return list: Subject class instances
+    """
     # Read the log file
-    log = pd.read_csv('../sourcedata/participants_log.tsv', sep='\t')
+    # It may be kept in an archive together with the source data (see sources.py)
+    source = sources.open_source(data_path)
+    log = pd.read_csv(io.BytesIO(source.read(source.local('participants_log.tsv'))), sep='\t')
 
     # Map handedness information from 0/1 to L/R
     log['Righthanded (1=yes, 0=no)'].replace({0: 'L', 1: 'R'}, inplace=True)
@@ -165,21 +322,9 @@ def main():
     id_pattern = r'p0\d\d'
     log = log[log.Parti_ID.str.match(id_pattern)]
 
-    # Create an empty dataframe with assigned column names as basis for future participants.tsv.
-    participants = pd.DataFrame(columns=['participant_id',
-                                         'age',
-                                         'hand',
-                                         'sex',
-                                         'stimuli_set',
-                                         'distractor',
-                                         'distractor_set'])
-
-    # Iterate through subjects: one subject - one row. SUBJECTS is a generated sequence of numbers
-    # and can be altered above.
-    for sub_id in SUBJECTS:
-        if sub_id == 49:
-            # Data for sub-49 not collected (see README/Missing data)
-            continue
+    participants = []
+    # Iterate through subjects: one subject - one row.
+    for sub_id in sub_ids:
         # This is the data row with participant data.
         participant_data = log.iloc[sub_id - 1]
 
@@ -194,38 +339,241 @@ def main():
         else:
             distractor_set = None
 
-        participant = s.Subject(sub_id, age, sex, hand, stimuli_set, distractor_set)
-
-        # There is an option to not just update text files but also convert source data anew with MNE-BIDS tool.
-        if not UPDATE_TEXT_ONLY:
+        participants.append(s.Subject(sub_id, age, sex, hand, stimuli_set, distractor_set, data_path))
+    return participants
 
-            # Transform accompanying data (EEG and behavioral).
-            #participant.eeg_to_bids()
-            participant.beh_to_bids()
 
-        # Append participant info to future participants.tsv
-        participants = pd.concat([participants, participant.data()], ignore_index=True)
+def add_subject_tasks(pipeline, participants, journal, shard=None, derivatives=False, epochs=False, runs=False,
+                      uploader=None):
+    """
+    Describe conversion of single subjects as tasks with their inputs and outputs (paths relative to BIDS_ROOT).
+    :param p.Pipeline pipeline: Pipeline to add the tasks to
+    :param list participants: Subject class instances to convert
+    :param staging.Journal journal: Journal of already published subjects, these are skipped
+    :param str shard: Shard of the run for run reports, e.g. 3/10 (None if not sharded)
+    :param bool derivatives: Whether to compute preprocessed derivatives of converted subjects
+    :param bool epochs: Whether to cache epochs of converted subjects
+    :param bool runs: Whether to split interrupted recordings and restarted experiments into runs, see SPLIT_RUNS
+    :param backend.Uploader uploader: Uploader to publish converted subjects with. None for no upload
+    """
+    for participant in participants:
+        sub = f'sub-{participant.id}'
+        # Peak memory of tasks loading the whole recording, used to keep parallel tasks within MEMORY_BUDGET
+        memory = participant.memory()
+        # Some subjects have no EEG recording (e.g. sub-20), only their behavioral data is converted
+        has_eeg = participant.source.size(participant.vhdr_path) > 0
+        pipeline.add(f'{sub}:participant', make_participant_fragment, participant,
+                     outputs=[f'.fragments/participants/{sub}.tsv'])
+
+        # Derivatives are cached, so they are cheap for subjects which do not change. They read the published
+        # subject, so they run after it in case it is converted in this run.
+        if derivatives and has_eeg and not UPDATE_TEXT_ONLY:
+            pipeline.add(f'{sub}:preproc', d.preprocess, participant, BIDS_ROOT, inputs=[sub],
+                         outputs=[f'derivatives/{d.PREPROC}/{sub}'], kind=p.CPU, memory=memory)
+        if epochs and has_eeg and not UPDATE_TEXT_ONLY:
+            # Epochs are cut from preprocessed data if it is computed in the same run
+            pipeline.add(f'{sub}:epochs', d.epoch, participant, BIDS_ROOT, None, derivatives,
+                         inputs=[sub, f'derivatives/{d.PREPROC}/{sub}'], outputs=[f'derivatives/{d.EPOCHS}/{sub}'],
+                         kind=p.CPU, memory=memory)
 
-    # Fill empty places in the dataset and overwrite generated participants.tsv from MNE-BIDS with newly created one.
-    participants.fillna('n/a', inplace=True)
-    filename = op.join(BIDS_ROOT, "participants.tsv")
-    participants.to_csv(filename, index=False, na_rep="n/a", sep="\t")
+        # There is an option to not just update text files but also convert source data anew with MNE-BIDS tool.
+        if UPDATE_TEXT_ONLY or (sub in journal and op.isdir(op.join(BIDS_ROOT, sub))):
+            continue
+        # Every subject is converted into its own staging root and published as a whole when complete.
+        stage = staging.staging_root(BIDS_ROOT, sub)
+        staged = f'{staging.STAGING}/{sub}'
+        eeg_files = [op.splitext(participant.vhdr_path)[0] + ext for ext in ['.vhdr', '.vmrk', '.eeg']]
+
+        # Every run is a task of its own, so runs are converted in parallel. Without runs, there is a single one (None),
+        # without EEG recording none. EEG and behavioral data are only split if their parts match.
+        beh_runs, note = participant.runs() if runs else ([None], None)
+        if note:
+            print(note)
+        eeg_runs = beh_runs if has_eeg else []
+
+        # Transform accompanying data (EEG and behavioral).
+        tasks = [pipeline.add(f'{sub}:clean', staging.clean, BIDS_ROOT, sub, outputs=[staged])]
+        if eeg_runs == [None]:
+            # The recording is copied as it is without loading the data, only the worker itself needs memory
+            tasks.append(pipeline.add(f'{sub}:eeg', participant.raw_to_bids, stage, inputs=eeg_files + [staged],
+                                      outputs=[f'{staged}/eeg'], kind=p.CPU,
+                                      size=sum(map(participant.source.size, eeg_files)), memory=s.WORKER_MEMORY))
+        elif eeg_runs:
+            # Runs are written into separate BIDS roots at the same time and merged afterwards
+            for run in eeg_runs:
+                tasks.append(pipeline.add(f'{sub}:eeg:run-{run}', participant.raw_to_bids,
+                                          staging.run_root(BIDS_ROOT, sub, run), run, inputs=eeg_files + [staged],
+                                          outputs=[f'{staged}/run-{run}'], kind=p.CPU,
+                                          memory=participant.memory(run)))
+            tasks.append(pipeline.add(f'{sub}:runs', staging.merge_runs, BIDS_ROOT, sub, eeg_runs,
+                                      inputs=[f'{staged}/run-{run}' for run in eeg_runs], outputs=[f'{staged}/eeg'],
+                                      size=sum(map(participant.source.size, eeg_files))))
+
+        written = []
+        for run in eeg_runs:
+            tag = f':run-{run}' if run else ''
+            tasks += [
+                pipeline.add(f'{sub}:events{tag}', participant.events_to_bids, stage, run, inputs=[f'{staged}/eeg'],
+                             outputs=[f'{staged}/eeg/events{tag}']),
+                pipeline.add(f'{sub}:sidecar{tag}', participant.eeg_sidecar_to_bids, stage, run,
+                             inputs=[f'{staged}/eeg'], outputs=[f'{staged}/eeg/sidecar{tag}']),
+            ]
+            written += [f'{staged}/eeg/events{tag}', f'{staged}/eeg/sidecar{tag}']
+        for run in beh_runs:
+            tag = f':run-{run}' if run else ''
+            tasks.append(pipeline.add(f'{sub}:beh{tag}', participant.beh_to_bids, stage, run,
+                                      inputs=[participant.beh_path, staged], outputs=[f'{staged}/beh{tag}'],
+                                      size=participant.source.size(participant.beh_path) if run is None else None))
+            written.append(f'{staged}/beh{tag}')
+        # Published JSON sidecars of the subject, which are deduplicated later (see add_merge_tasks())
+        sidecars = [f'{sub}/eeg/{sub}_task-{participant.task}{f"_run-{run:02d}" if run else ""}_{suffix}.json'
+                    for run in eeg_runs for suffix in ['eeg', 'events']]
+        sidecars += [f'{sub}/beh/{sub}_task-{participant.task}{f"_run-{run:02d}" if run else ""}_beh.json'
+                     for run in beh_runs]
+        tasks.append(pipeline.add(f'{sub}:publish', staging.publish, BIDS_ROOT, sub, journal, inputs=written,
+                                  outputs=[sub, f'.published/{sub}'] + sidecars))
+        pipeline.add(f'{sub}:report', make_report, participant, shard, tasks, note, inputs=[sub],
+                     outputs=[f'.fragments/reports/{sub}.json'])
+        # Upload the subject while others are still being converted. Only its publishing is waited for (the marker
+        # .published/sub-XX is written by nothing else), sidecars deduplicated meanwhile are left to the final upload.
+        if uploader is not None:
+            pipeline.add(f'{sub}:upload', uploader.sync, [sub], inputs=[f'.published/{sub}'],
+                         outputs=[f'.upload/{sub}'])
+
+
+def add_merge_tasks(pipeline, derivatives=False, epochs=False, uploader=None):
+    """
+    Describe creation of dataset-level files as tasks. These only depend on subject tasks of the same run, results
+    of other (sharded) runs are taken from the fragments folder.
+    :param p.Pipeline pipeline: Pipeline to add the tasks to
+    :param bool derivatives: Whether to write dataset-level files of preprocessed derivatives
+    :param bool epochs: Whether to write dataset-level files of cached epochs
+    :param backend.Uploader uploader: Uploader to publish the dataset with. None for no upload
+    """
+    fragments = [task.outputs[0] for task in pipeline.tasks if task.name.endswith(':participant')]
+    pipeline.add('participants', make_participants, inputs=fragments, outputs=['participants.tsv'])
 
-    # Once again, copy stimui folder if more than a text update is needed.
+    # Copy stimuli from sourcedata
     if not UPDATE_TEXT_ONLY:
-        # Copy stimuli from sourcedata
-        copy_tree(op.join(DATA_PATH, "stimuli"), op.join(BIDS_ROOT, "stimuli"))
+        pipeline.add('stimuli', make_stimuli, outputs=['stimuli'], size=p.tree_size(op.join(DATA_PATH, "stimuli")))
 
     # Finish up with self-explanatory annotations and config files.
-    make_dataset_description()
-    make_participants_json()
+    pipeline.add('dataset_description', make_dataset_description, outputs=['dataset_description.json'],
+                 size=len(textfiles.dumps(textfiles.dataset_description()).encode()))
+    pipeline.add('participants_json', make_participants_json, outputs=['participants.json'],
+                 size=len(textfiles.dumps(textfiles.participants()).encode()))
+
+    pipeline.add('readme', make_readme, outputs=['README.md', 'README'], size=len(textfiles.readme().encode()))
+    pipeline.add('license', make_license, outputs=['LICENSE'])
+    pipeline.add('changes', make_changes, outputs=['CHANGES'], size=len(textfiles.changes().encode()))
+
+    pipeline.add('bidsignore', make_bidsignore, outputs=['.bidsignore'], size=len(textfiles.bidsignore().encode()))
+    pipeline.add('validator_config', make_bids_validator_config, outputs=['.bids-validator-config.json'])
+
+    # Deduplicate sidecars once all subjects of this run are published. Subject sidecars are rewritten as well, while
+    # tasks reading a published subject may run: MNE-BIDS reads *_eeg.json in preproc and epochs. Sidecars are replaced
+    # atomically (see textfiles.write()) and the *_eeg.json of a subject keeps the keys MNE-BIDS reads, so it is never
+    # removed (see inheritance.SUBJECT_KEYS). Readers see the old or the new file with the same values.
+    if INHERIT_SIDECARS:
+        published = [task for task in pipeline.tasks if task.name.endswith(':publish')]
+        sidecars = [output for task in published for output in task.outputs if output.endswith('.json')]
+        pipeline.add('inheritance', inheritance.deduplicate_all, BIDS_ROOT,
+                     inputs=[task.outputs[0] for task in published],
+                     outputs=sidecars + [f'task-{task}_{suffix}.json' for task in inheritance.TASKS
+                                         for _, suffix in inheritance.SIDECARS])
+
+    if derivatives:
+        pipeline.add('preproc_description', d.make_description, d.PREPROC, BIDS_ROOT,
+                     outputs=[f'derivatives/{d.PREPROC}/dataset_description.json'])
+    if epochs:
+        pipeline.add('epochs_description', d.make_description, d.EPOCHS, BIDS_ROOT,
+                     outputs=[f'derivatives/{d.EPOCHS}/dataset_description.json'])
+
+    # Finally, upload what is new or changed (e.g. subject sidecars deduplicated above) once everything is written.
+    # Subjects uploaded before are skipped by their checksums.
+    if uploader is not None:
+        written = sorted({output for task in pipeline.tasks for output in task.outputs})
+        pipeline.add('upload', upload_dataset, uploader, inputs=written)
+
+
+def parse_shard(text):
+    """
+    Helper function to read a shard given on the command line
+    :param str text: Shard in format i/N, e.g. 3/10
+    :return tuple: (i, N)
+    """
+    index, count = (int(number) for number in text.split('/'))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f'Shard {text} is not in format i/N with 1 <= i <= N')
+    return index, count
+
+
+def parse_subjects(text):
+    """
+    Helper function to read subject IDs given on the command line
+    :param str text: Comma-separated IDs and ranges, e.g. 1,2,10-15
+    :return list: Subject IDs
+    """
+    sub_ids = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        sub_ids += range(int(first), int(last or first) + 1)
+    return sub_ids
 
-    make_readme()
-    make_license()
-    make_changes()
 
-    make_bidsignore()
-    make_bids_validator_config()
+def main():
+    # Main idea is: process the participants_log.tsv line by line and transform accompanying subject data.
+    # Every conversion step becomes a task, and independent tasks run in parallel.
+    parser = argparse.ArgumentParser(description='Convert MemorEEG source data into BIDS.')
+    parser.add_argument('--shard', type=parse_shard,
+                        help='Convert only the i-th of N parts of the subjects (format: i/N). Dataset-level files are '
+                             'not written, run with --merge once all shards are done.')
+    parser.add_argument('--subjects', type=parse_subjects,
+                        help='Convert only the given subjects, e.g. 1,2,10-15. Dataset-level files are not written.')
+    parser.add_argument('--merge', action='store_true',
+                        help='Do not convert subjects, only write participants.tsv and dataset-level files.')
+    parser.add_argument('--dry-run', action='store_true', default=DRY_RUN,
+                        help='Only print the conversion plan.')
+    parser.add_argument('--derivatives', action='store_true', default=DERIVATIVES,
+                        help='Compute preprocessed EEG derivatives as well (settings in derivatives.py).')
+    parser.add_argument('--epochs', action='store_true', default=EPOCHS,
+                        help='Cache EEG epochs around decoded events as well (settings in derivatives.py).')
+    parser.add_argument('--runs', action='store_true', default=SPLIT_RUNS,
+                        help='Write interrupted recordings and restarted experiments as separate runs.')
+    parser.add_argument('--memory-budget', type=lambda value: int(float(value) * 1024 ** 3), default=MEMORY_BUDGET,
+                        help='Memory in GB that EEG conversion tasks may use together (default: 80%% of RAM).')
+    parser.add_argument('--upload', default=UPLOAD,
+                        help='Upload the dataset while converting it: s3://bucket/prefix or a folder.')
+    args = parser.parse_args()
+    # Derivatives read the converted recording of a subject as a single file
+    if args.runs and (args.derivatives or args.epochs):
+        parser.error('--runs cannot be combined with --derivatives or --epochs')
+
+    uploader = backend.Uploader(backend.open_backend(args.upload), BIDS_ROOT) if args.upload else None
+    pipeline = p.Pipeline()
+    if not args.merge:
+        sub_ids = select_subjects(args.subjects, args.shard)
+        participants = read_participants(sub_ids)
+        subs = [f'sub-{participant.id}' for participant in participants]
+
+        # Pick up where an interrupted run stopped: finish half-done publishing and skip published subjects.
+        # Every shard keeps its own journal, but subjects published by any of them are skipped.
+        suffix = f'-{args.shard[0]}of{args.shard[1]}' if args.shard else ''
+        journal = staging.Journal(op.join(BIDS_ROOT, staging.STAGING, f"journal{suffix}.tsv"),
+                                  glob.glob(op.join(BIDS_ROOT, staging.STAGING, "journal*.tsv")))
+        if not args.dry_run:
+            staging.recover(BIDS_ROOT, subs)
+            if not RESUME:
+                journal.reset()
+
+        shard = '/'.join(str(number) for number in args.shard) if args.shard else None
+        add_subject_tasks(pipeline, participants, journal, shard, args.derivatives, args.epochs, args.runs, uploader)
+
+    # Sharded runs leave dataset-level files to a separate merge run.
+    if args.merge or not (args.shard or args.subjects):
+        add_merge_tasks(pipeline, args.derivatives, args.epochs, uploader)
+
+    pipeline.run(cpu_jobs=CPU_JOBS, io_jobs=IO_JOBS, dry_run=args.dry_run, memory_budget=args.memory_budget)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,255 @@
+"""
+Following code gives access to source data which is kept in archives (e.g. p001.tar.gz or p001.zip in sourcedata, as
+delivered by the file server) without extracting them first. Archives may contain the usual folder structure
+(eeg/p001.vhdr, behavioral/resultfile_p001.txt...), optionally below a top-level folder.
+
+Small files (headers, markers, behavioral data, participants_log.tsv) are read directly from the archive members.
+Files which have to exist on disk (BrainVision recordings for MNE or memory mapping) are extracted when needed, into
+sourcedata/.extracted, and only once. Files which exist in sourcedata as they are always take precedence, so a
+folder without archives works exactly as before.
+
+Only .zip and plain .tar archives can be read at any position. A compressed tar (.tar.gz, .tgz) has to be decompressed
+from its start up to a member every time the member is read, so its small text files are extracted into
+sourcedata/.extracted while the archive is listed, in the same pass, and read from disk afterwards.
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os
+import os.path as op
+import glob
+import shutil
+import tarfile
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Archive file names in the source data folder
+ARCHIVES = ["*.tar", "*.tar.gz", "*.tgz", "*.zip"]
+# Folders of the source data structure. Archive members are found by the part of their path starting with one of
+# these, e.g. p001/eeg/p001.vhdr is eeg/p001.vhdr.
+FOLDERS = ["eeg", "behavioral", "eyetracking", "stimuli", "irb_data_protection"]
+# Folder for extracted files, inside the source data folder
+EXTRACTED = ".extracted"
+# Number of files extracted at the same time
+EXTRACT_JOBS = 4
+# Block size for extracting files
+BLOCK_SIZE = 4 * 1024 * 1024
+# Small text files of compressed tar archives which are extracted while listing the archive: extensions and size limit
+TEXT_FILES = [".vhdr", ".vmrk", ".txt", ".tsv"]
+TEXT_SIZE = 16 * 1024 * 1024
+
+
+def _relative(name):
+    """
+    Helper function to find the source data path of an archive member
+    :param str name: Member name, e.g. p001/eeg/p001.vhdr
+    :return str: Path in the source data structure, e.g. eeg/p001.vhdr
+    """
+    parts = name.strip("/").split("/")
+    for index, part in enumerate(parts):
+        if part in FOLDERS or index == len(parts) - 1:
+            return "/".join(parts[index:])
+
+
+class Source:
+    """
+    Class represents the source data folder together with the archives in it. Files are addressed by their local
+    paths, i.e. where they are (sourcedata/eeg/p001.vhdr) or will be when extracted (sourcedata/.extracted/eeg/...).
+    """
+
+    def __init__(self, data_path):
+        """
+        Construct Source class instance. Archives are listed when a file is first looked for.
+        :param str data_path: Root folder with source data
+        """
+        self.data_path = data_path
+        self.extract_root = op.join(data_path, EXTRACTED)
+        self._members = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Sources travel to worker processes together with Subject class instances. Locks cannot be pickled.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def members(self):
+        """
+        List members of all archives. Small text files of compressed tars (see TEXT_FILES) are extracted on the way.
+        :return dict: Source data paths (e.g. eeg/p001.vhdr) mapped to (archive path, member info, size). The member
+        info is a ZipInfo or TarInfo, which lets the member be opened without searching the archive for it again
+        """
+        with self._lock:
+            if self._members is None:
+                members = {}
+                archives = sorted({path for pattern in ARCHIVES
+                                   for path in glob.glob(op.join(self.data_path, pattern))})
+                for archive in archives:
+                    if archive.endswith(".zip"):
+                        with zipfile.ZipFile(archive) as data:
+                            entries = [(info.filename, info, info.file_size) for info in data.infolist()
+                                       if not info.is_dir()]
+                    else:
+                        entries = self._list_tar(archive)
+                    for name, info, size in entries:
+                        members[_relative(name)] = (archive, info, size)
+                self._members = members
+            return self._members
+
+    def _list_tar(self, archive):
+        """
+        Helper function to list members of a tar archive in a single pass over it. Small text files of a compressed
+        archive are extracted on the way, since reading them later would decompress the archive up to them again.
+        :param str archive: Path of the archive
+        :return list: Members as (member name, TarInfo, size)
+        """
+        entries = []
+        compressed = not archive.endswith(".tar")
+        with tarfile.open(archive) as data:
+            for info in data:
+                if not info.isfile():
+                    continue
+                entries.append((info.name, info, info.size))
+                relative = _relative(info.name)
+                path = op.join(self.extract_root, relative)
+                if (compressed and op.splitext(relative)[1] in TEXT_FILES and info.size <= TEXT_SIZE
+                        and not op.exists(op.join(self.data_path, relative)) and not op.isfile(path)):
+                    with data.extractfile(info) as member:
+                        self._write(member, path)
+        return entries
+
+    def local(self, relative):
+        """
+        Determine the local path of a source file
+        :param str relative: Path in the source data structure, e.g. eeg/p001.vhdr
+        :return str: Path in the source data folder if the file exists there (or nowhere), otherwise the path it is
+        extracted to
+        """
+        path = op.join(self.data_path, relative)
+        if op.exists(path) or relative not in self.members():
+            return path
+        return op.join(self.extract_root, relative)
+
+    def _member(self, path):
+        """
+        Helper function to find the archive member of a local path
+        :return tuple: (archive path, member info, size), raises FileNotFoundError if there is none
+        """
+        for root in [self.extract_root, self.data_path]:
+            relative = op.relpath(path, root).replace(os.sep, "/")
+            if not relative.startswith("..") and relative in self.members():
+                return self.members()[relative]
+        raise FileNotFoundError(path)
+
+    def _open(self, archive, info):
+        """
+        Helper function to open an archive member for reading. Every call opens the archive anew, so that members can
+        be read from several threads at the same time. A tar member is found by its TarInfo offset, the archive is not
+        listed again.
+        :return tuple: (archive, member file object), both to be closed by the caller
+        """
+        if archive.endswith(".zip"):
+            data = zipfile.ZipFile(archive)
+            return data, data.open(info)
+        data = tarfile.open(archive)
+        return data, data.extractfile(info)
+
+    def _write(self, member, path):
+        """
+        Helper function to write an archive member to disk. It is written under a temporary name and renamed, so an
+        interrupted extraction is never taken for a complete file.
+        :param member: Member file object
+        :param str path: Local path to write to
+        """
+        os.makedirs(op.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as output:
+            shutil.copyfileobj(member, output, BLOCK_SIZE)
+        os.replace(temporary, path)
+
+    def read(self, path):
+        """
+        Read a source file, from disk if it exists there, otherwise directly from its archive
+        :param str path: Local path, see local()
+        :return bytes: Contents
+        """
+        if op.isfile(path):
+            with open(path, "rb") as data:
+                return data.read()
+        archive, info, _ = self._member(path)
+        data, member = self._open(archive, info)
+        with data, member:
+            return member.read()
+
+    def size(self, path):
+        """
+        :param str path: Local path, see local()
+        :return int: Size of a source file in bytes, 0 if it does not exist
+        """
+        if op.isfile(path):
+            return op.getsize(path)
+        try:
+            return self._member(path)[2]
+        except FileNotFoundError:
+            return 0
+
+    def ensure(self, path):
+        """
+        Make sure a source file exists on disk, extracting it from its archive if needed
+        :param str path: Local path, see local()
+        :return str: The same path
+        """
+        if op.isfile(path):
+            return path
+        archive, info, _ = self._member(path)
+        data, member = self._open(archive, info)
+        with data, member:
+            self._write(member, path)
+        return path
+
+    def prefetch(self, paths, jobs=EXTRACT_JOBS):
+        """
+        Make sure several source files exist on disk, extracting them in parallel
+        :param list paths: Local paths, see local()
+        :param int jobs: Number of files extracted at the same time
+        :return list: The same paths
+        """
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            return list(pool.map(self.ensure, paths))
+
+
+# Sources by data path, so that archives are listed once per process
+_SOURCES = {}
+
+
+def open_source(data_path):
+    """
+    Get the source of a source data folder
+    :param str data_path: Root folder with source data
+    :return Source: Source class instance, shared by all callers with the same folder
+    """
+    data_path = op.realpath(data_path)
+    if data_path not in _SOURCES:
+        _SOURCES[data_path] = Source(data_path)
+    return _SOURCES[data_path]
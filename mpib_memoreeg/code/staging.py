@@ -0,0 +1,221 @@
+"""
+Following code lets every subject be converted into a separate staging folder first and publishes it into BIDS_ROOT
+by renaming the complete folder. A journal keeps track of published subjects, so that an interrupted conversion can
+resume with the next subject instead of starting again. This file is NECESSARY to successfully execute source2bids.py.
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os
+import os.path as op
+import shutil
+import threading
+from datetime import datetime
+
+# Name of the staging folder inside BIDS_ROOT. It has to be on the same file system as BIDS_ROOT for renames to be
+# atomic, and as a hidden folder it is ignored by the BIDS validator.
+STAGING = ".staging"
+# Suffix of live subject folders which are being replaced by a new conversion
+OLD_SUFFIX = ".old"
+
+
+def staging_root(bids_root, sub):
+    """
+    Helper function to determine where a subject is converted before publishing. Every subject gets its own small
+    BIDS root, so that files MNE-BIDS writes for the whole dataset (participants.tsv, README...) do not collide.
+    :param str bids_root: Location of the dataset
+    :param str sub: Subject folder name (format: sub-XX)
+    :return str: Path of the staging BIDS root for the subject
+    """
+    return op.join(bids_root, STAGING, sub)
+
+
+def run_root(bids_root, sub, run):
+    """
+    Helper function to determine where a single run of a subject is written. Runs are written at the same time, and
+    every one of them gets its own BIDS root so that MNE-BIDS does not update the same scans.tsv concurrently.
+    :param str bids_root: Location of the dataset
+    :param str sub: Subject folder name (format: sub-XX)
+    :param int run: Run number
+    :return str: Path of the staging BIDS root for the run, inside the one of the subject
+    """
+    return op.join(staging_root(bids_root, sub), f"run-{run}")
+
+
+def merge_runs(bids_root, sub, runs):
+    """
+    Move files of separately written runs into the staging BIDS root of the subject and combine their scans.tsv
+    :param str bids_root: Location of the dataset
+    :param str sub: Subject folder name (format: sub-XX)
+    :param list runs: Run numbers
+    """
+    target = op.join(staging_root(bids_root, sub), sub)
+    scans = op.join(target, f"{sub}_scans.tsv")
+    header = None
+    rows = []
+    for run in runs:
+        source = op.join(run_root(bids_root, sub, run), sub)
+        for folder, _, names in os.walk(source):
+            relative = op.relpath(folder, source)
+            for name in names:
+                if name == op.basename(scans):
+                    with open(op.join(folder, name), "r", encoding="utf-8") as lines:
+                        header, *run_rows = lines.read().splitlines()
+                    rows += run_rows
+                    continue
+                os.makedirs(op.join(target, relative), exist_ok=True)
+                os.replace(op.join(folder, name), op.join(target, relative, name))
+        shutil.rmtree(run_root(bids_root, sub, run))
+
+    if header is not None:
+        with open(scans, "w", encoding="utf-8") as output:
+            output.write("\n".join([header] + sorted(rows)) + "\n")
+
+
+def clean(bids_root, sub):
+    """
+    Remove leftovers of a previous (interrupted) conversion of a subject from the staging folder.
+    :param str bids_root: Location of the dataset
+    :param str sub: Subject folder name (format: sub-XX)
+    """
+    shutil.rmtree(staging_root(bids_root, sub), ignore_errors=True)
+
+
+def recover(bids_root, subs):
+    """
+    Finish publishing interrupted between the two renames in publish(): if a live subject folder has been moved
+    aside but the new one did not take its place, put the old one back. Otherwise, the old one is not needed anymore.
+    Only subjects of the current run are recovered, other runs may be publishing their subjects at the same time.
+    :param str bids_root: Location of the dataset
+    :param list subs: Subject folder names (format: sub-XX) to recover
+    """
+    staging = op.join(bids_root, STAGING)
+    if not op.isdir(staging):
+        return
+    for name in os.listdir(staging):
+        if not name.endswith(OLD_SUFFIX) or name[:-len(OLD_SUFFIX)] not in subs:
+            continue
+        old = op.join(staging, name)
+        live = op.join(bids_root, name[:-len(OLD_SUFFIX)])
+        if op.exists(live):
+            shutil.rmtree(old)
+        else:
+            os.rename(old, live)
+
+
+def publish(bids_root, sub, journal=None):
+    """
+    Move a completely converted subject from the staging folder into BIDS_ROOT and record it in the journal.
+    A new subject appears in BIDS_ROOT with a single rename. An existing subject is moved aside first, so readers of
+    the dataset see either the complete old or the complete new subject folder (or, for a moment, none of them).
+    :param str bids_root: Location of the dataset
+    :param str sub: Subject folder name (format: sub-XX)
+    :param Journal journal: Journal to record the published subject in. Can be None
+    """
+    staged = op.join(staging_root(bids_root, sub), sub)
+    live = op.join(bids_root, sub)
+    old = op.join(bids_root, STAGING, sub + OLD_SUFFIX)
+
+    if op.exists(live):
+        shutil.rmtree(old, ignore_errors=True)
+        os.rename(live, old)
+    os.rename(staged, live)
+    shutil.rmtree(old, ignore_errors=True)
+
+    # Everything else in the staging root (e.g. participants.tsv from MNE-BIDS) is not needed anymore
+    clean(bids_root, sub)
+    if journal is not None:
+        journal.record(sub)
+
+
+class Journal:
+    """
+    Class represents a list of subjects which have been completely converted and published. The list is kept in a
+    tab-separated file with one subject per line, every line is written to disk before the next subject is published.
+    Runs working on the same dataset at the same time (e.g. shards) write separate journals, but may read each other's.
+    """
+
+    def __init__(self, path, shared=()):
+        """
+        Construct Journal class instance and read subjects recorded by previous runs
+        :param str path: Location of the journal file
+        :param shared: Locations of journal files of other runs, only read
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        # Subject folder name -> time of its last publishing (ISO format), over all read journals
+        self.published = {}
+        for journal_path in {path, *shared}:
+            if op.exists(journal_path):
+                with open(journal_path, "r", encoding="utf-8") as journal:
+                    for line in journal:
+                        if line.strip():
+                            sub, _, when = line.rstrip("\n").partition("\t")
+                            self.done.add(sub)
+                            self.published[sub] = max(self.published.get(sub, when), when)
+
+    def __contains__(self, sub):
+        return sub in self.done
+
+    def record(self, sub):
+        """
+        Record a published subject
+        :param str sub: Subject folder name (format: sub-XX)
+        """
+        with self._lock:
+            os.makedirs(op.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as journal:
+                when = datetime.now().isoformat(timespec='seconds')
+                journal.write(f"{sub}\t{when}\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+            self.done.add(sub)
+            self.published[sub] = when
+
+    def forget(self, sub):
+        """
+        Forget a recorded subject, e.g. because its source data changed and it has to be converted again. It is removed
+        from the journal file as well, so that a run started after an interruption does not skip it. Journals of other
+        runs are left as they are.
+        :param str sub: Subject folder name (format: sub-XX)
+        """
+        with self._lock:
+            self.done.discard(sub)
+            self.published.pop(sub, None)
+            if not op.exists(self.path):
+                return
+            with open(self.path, "r", encoding="utf-8") as journal:
+                lines = [line for line in journal if line.split("\t")[0] != sub]
+            # Written under a temporary name and renamed, an interruption leaves the old or the new journal
+            with open(self.path + ".tmp", "w", encoding="utf-8") as journal:
+                journal.writelines(lines)
+                journal.flush()
+                os.fsync(journal.fileno())
+            os.replace(self.path + ".tmp", self.path)
+
+    def reset(self):
+        """
+        Forget all recorded subjects, e.g. to convert the whole dataset anew
+        """
+        with self._lock:
+            if op.exists(self.path):
+                os.remove(self.path)
+            self.done = set()
+            self.published = {}
@@ -21,23 +21,37 @@ TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR TH
 SOFTWARE.
 """
 # Import necessary packages
+import io
 import os.path as op
+from datetime import timedelta
 import mne
-import shutil
 import json
 import textfiles
+import brainvision
+import sources
+import numpy as np
 import pandas as pd
 from mne_bids import BIDSPath, write_raw_bids
 
 # Default sourcedata path and BIDS path.
 DATA_PATH = op.join(op.dirname(op.realpath(__file__)), "../sourcedata")
 BIDS_ROOT = op.join(op.dirname(op.realpath(__file__)), "..")
+# Types of channels which are not EEG (MNE names, channels.tsv uses them in upper case)
+CHANNEL_TYPES = {"ECG": "ecg", "HEOG": "eog", "VEOG": "eog"}
+# Peak memory of processing a recording: MNE holds the data as float64, and filtering or resampling needs copies of it.
+# Every worker process needs some memory of its own (Python, MNE and its dependencies) on top of that.
+MEMORY_FACTOR = 2
+WORKER_MEMORY = 300 * 1024 * 1024
 
 
 class Subject:
     """
     Class represents key data parameters for a single participant and allows for easier formatting.
     """
+    # Instances are kept for the whole cohort at once (e.g. in QC) and sent to worker processes, so they carry no
+    # per-instance dictionary
+    __slots__ = ('id', 'age', 'sex', 'hand', 'stimuli', 'distractors', 'task', 'source')
+
     # Stimulus matrix determines how stimulus IDs are assigned during the trials. E.g., STIM_MAT[1,2] contains
     # filename for 3rd stimulus in the 2nd subset (python iteration from 0).
     # I also needed to reverse-engineer this one, so I'll protect it at all costs :)
@@ -58,7 +72,8 @@ class Subject:
         :param str hand: Dominating hand of a subject. (L/R)
         :param int stimuli: Chosen stimuli subset, number from 1 to 3
         :param int distractors: Chosen distractors subset, number from 1 to 3. Can be None if no distractors are used
-        :param str data_path: Root folder with source data. See code/README for more
+        :param str data_path: Root folder with source data, optionally with archives (see sources.py). See code/README
+        for more. None for a subject of a converted dataset without its source data (e.g. in dataset.py)
         """
         # Create a BIDS-ID for the subject (format: sub-XX)
         self.id = f'{subject_id:02}'
@@ -75,11 +90,26 @@ class Subject:
         else:
             self.task = 'nodistractor'
 
-        # Determine locations of EEG and behavioral data
-        self.vhdr_path = op.join(data_path, f'eeg/p0{self.id}.vhdr')
-        self.beh_path = op.join(data_path, f"behavioral/resultfile_p0{self.id}.txt")
+        # Source data kept in archives is read from there directly, files which have to be on disk are extracted next
+        # to it when needed. Archives are only listed once a source file is looked for (see vhdr_path, beh_path).
+        self.source = sources.open_source(data_path) if data_path is not None else None
+
+    @property
+    def vhdr_path(self):
+        """
+        :return str: Local path of the source EEG header (see sources.Source.local()), None without source data
+        """
+        return self.source.local(f'eeg/p0{self.id}.vhdr') if self.source is not None else None
+
+    @property
+    def beh_path(self):
+        """
+        :return str: Local path of the source behavioral data (see sources.Source.local()), None without source data
+        """
+        return self.source.local(f"behavioral/resultfile_p0{self.id}.txt") if self.source is not None else None
 
-    def get_event_type(self, trigger_id):
+    @staticmethod
+    def get_event_type(trigger_id):
         """
         Helper function to determine type of event from its trigger ID
         :param int trigger_id: Trigger ID, ranges from 1 to 245
@@ -137,6 +167,115 @@ class Subject:
             case _:
                 return 'n/a'
 
+    def eeg_data(self):
+        """
+        Map the source EEG data into memory, see brainvision.memmap(). Data kept in an archive is extracted first.
+        :return np.memmap: Data in raw units, shape (samples, channels)
+        """
+        header = self.header()
+        self.source.ensure(header["data_file"])
+        return brainvision.memmap(header)
+
+    def header(self):
+        """
+        Read recording parameters of the source EEG data, see brainvision.read_header()
+        :return dict: Recording parameters
+        """
+        return brainvision.read_header(self.vhdr_path, self.source.read)
+
+    def triggers(self):
+        """
+        Read triggers of the source EEG data as arrays, without loading the recording itself
+        :return tuple: (samples, trigger IDs, event types) as NumPy arrays. Event types are indices into EVENT_TYPES
+        """
+        samples, codes = brainvision.stimulus_markers(self.header()["marker_file"], self.source.read)
+        return samples, codes, EVENT_LUT[codes]
+
+    def eeg_segments(self):
+        """
+        Find segments of the source EEG data: the recording is interrupted (e.g. restarted or paused) wherever
+        BrainVision Recorder has set a New Segment marker
+        :return list: Segments as (first sample, sample after the last one), in recording order
+        """
+        header = self.header()
+        n_samples = brainvision.n_samples(header, self.source.size(header["data_file"]))
+        markers = brainvision.read_markers(header["marker_file"], self.source.read)
+        starts = sorted({0} | {sample for kind, _, sample, _ in markers
+                               if kind == "New Segment" and 0 < sample < n_samples})
+        return list(zip(starts, starts[1:] + [n_samples]))
+
+    def beh_segments(self):
+        """
+        Read the source behavioral data and split it where the experiment has been restarted, i.e. where trial numbers
+        start anew
+        :return list: Dataframes (all values as strings without whitespaces), one per start of the experiment
+        """
+        beh_data = pd.read_csv(io.BytesIO(self.source.read(self.beh_path)), sep='\t')
+
+        # It is not enough to just use any number of whitespaces as delimiter. One edge case supposes that the
+        # participant has neither changed the object, nor the orientation (e.g. the correct object has spawned in the
+        # correct orientation). This means some data will be filled with whitespaces, and this causes data shift for
+        # some trials when using delim_whitespace=True. So I'm stripping the whitespaces semi-manually.
+        beh_data = beh_data.applymap(lambda x: str(x).replace(" ", ""))
+        beh_data.columns = beh_data.columns.str.replace(" ", "")
+
+        # Drop duplicate header rows (needs to happen before checking for empty cells!)
+        beh_data = beh_data[beh_data.iloc[:, 0] != beh_data.columns[0]]
+
+        # A restart begins with a trial number not greater than the one before
+        trials = pd.to_numeric(beh_data['trial'], errors='coerce')
+        restarts = (trials.diff() <= 0).cumsum()
+        return [segment for _, segment in beh_data.groupby(restarts.to_numpy(), sort=True)] or [beh_data]
+
+    def runs(self):
+        """
+        Match segments of the EEG data (see eeg_segments()) with starts of the experiment (see beh_segments()), so that
+        both are split into the same runs. They only match if there are as many segments as starts and every segment
+        has as many complete trials (feedback markers) as the behavioral data of its start. A recording paused without
+        restarting the experiment (e.g. sub-63) does not match and is not split. If only one of both is there, it is
+        split on its own.
+        :return tuple: (run numbers, note). Run numbers are [None] if the data is not split into runs, the note tells
+        why the data has not been split although it has been interrupted (None otherwise)
+        """
+        try:
+            beh_trials = [len(segment) for segment in self.beh_segments()]
+        except FileNotFoundError:
+            beh_trials = None
+        try:
+            starts = [start for start, _ in self.eeg_segments()]
+            samples, _, types = self.triggers()
+            feedback = samples[types == EVENT_TYPES.index('feedback')]
+            eeg_trials = np.bincount(np.searchsorted(starts, feedback, side='right') - 1, minlength=len(starts))
+            eeg_trials = [int(count) for count in eeg_trials]
+        except (FileNotFoundError, KeyError):
+            eeg_trials = None
+
+        counts = [trials for trials in [eeg_trials, beh_trials] if trials is not None]
+        count = max(map(len, counts), default=1)
+        if count == 1:
+            return [None], None
+        if all(trials == counts[0] for trials in counts):
+            return list(range(1, count + 1)), None
+        note = (f"sub-{self.id}: {len(eeg_trials)} EEG segment(s) with {eeg_trials} complete trials do not match "
+                f"{len(beh_trials)} start(s) of the experiment with {beh_trials} trials, not split into runs")
+        return [None], note
+
+    def memory(self, run=None):
+        """
+        Estimate peak memory of processing the EEG data of the subject from the header and the size of the binary file
+        :param int run: Run number to estimate the memory for a single segment, see eeg_segments(). None for all data
+        :return int: Memory in bytes. Only WORKER_MEMORY if the EEG data is missing
+        """
+        try:
+            header = self.header()
+            if run:
+                start, stop = self.eeg_segments()[run - 1]
+                n_samples = stop - start
+            else:
+                n_samples = brainvision.n_samples(header, self.source.size(header["data_file"]))
+        except (FileNotFoundError, KeyError):
+            return WORKER_MEMORY
+        return WORKER_MEMORY + MEMORY_FACTOR * n_samples * header["n_channels"] * np.dtype(np.float64).itemsize
 
     def eeg_to_bids(self, bids_root=BIDS_ROOT):
         """
@@ -144,109 +283,162 @@ class Subject:
         Per default, the data will be expanded into home directory of the script
         :param str bids_root: New location of the data
         """
-        # First, let's find and read the source EEG data
+        self.raw_to_bids(bids_root)
+        self.events_to_bids(bids_root)
+        self.eeg_sidecar_to_bids(bids_root)
+
+    def raw_to_bids(self, bids_root=BIDS_ROOT, run=None):
+        """
+        Write the BrainVision recording with MNE-BIDS. Events and sidecars are cleaned up separately by
+        events_to_bids() and eeg_sidecar_to_bids(), which both expect this step to be done.
+        :param str bids_root: New location of the data
+        :param int run: Write only this segment of the recording (see eeg_segments()) as a run. None for all data
+        """
+        # First, let's find and read the source EEG data. Files kept in archives are extracted in parallel first.
+        header = self.header()
+        self.source.prefetch([self.vhdr_path, header["marker_file"], header["data_file"]])
         raw = mne.io.read_raw_brainvision(self.vhdr_path)
 
         # Add known metadata
-        raw = raw.set_channel_types({"ECG": "ecg", "HEOG": "eog", "VEOG": "eog"})
+        raw = raw.set_channel_types(CHANNEL_TYPES)
         raw.info["line_freq"] = 50
 
         # Use mne-bids to expand the existing data
-        bids_path = BIDSPath(subject=self.id, task=self.task, root=bids_root)
-        write_raw_bids(raw, bids_path, overwrite=True)
-
-        # Cleaning auto-generated events.tsv from mne-bids
-
-        # Second, let's find where the auto-generated _events.tsv file is.
-        events_path = BIDSPath(subject=self.id, task=self.task, root=bids_root, datatype='eeg', suffix='events',
-                               extension=".tsv")
+        bids_path = BIDSPath(subject=self.id, task=self.task, run=run, root=bids_root)
+        if run is None:
+            write_raw_bids(raw, bids_path, overwrite=True)
+            return
+
+        # A single segment is cut out and written anew. Only this segment is loaded into memory.
+        start, stop = self.eeg_segments()[run - 1]
+        raw.crop(tmin=start / raw.info["sfreq"], tmax=(stop - 1) / raw.info["sfreq"]).load_data()
+        # MNE keeps annotations up to one sample after the end, i.e. the New Segment marker of the next segment
+        after_end = raw.time_as_index(raw.annotations.onset, use_rounding=True,
+                                      origin=raw.annotations.orig_time) >= raw.n_times
+        raw.annotations.delete(np.flatnonzero(after_end))
+        # MNE-BIDS takes acq_time of *_scans.tsv from meas_date, i.e. the start of the whole recording. Move it to the
+        # first sample of the segment. Annotations are kept relative to meas_date, events keep their samples.
+        if raw.info["meas_date"] is not None:
+            raw.set_meas_date(raw.info["meas_date"] + timedelta(seconds=start / raw.info["sfreq"]))
+        write_raw_bids(raw, bids_path, overwrite=True, allow_preload=True, format="BrainVision")
+
+    def events_to_bids(self, bids_root=BIDS_ROOT, run=None):
+        """
+        Clean the auto-generated _events.tsv from MNE-BIDS and add a JSON sidecar describing it
+        :param str bids_root: Location of the converted data
+        :param int run: Run number, see raw_to_bids(). None if the recording is not split into runs
+        """
+        # First, let's find where the auto-generated _events.tsv file is.
+        events_path = BIDSPath(subject=self.id, task=self.task, run=run, root=bids_root, datatype='eeg',
+                               suffix='events', extension=".tsv")
         events = pd.read_csv(events_path, sep="\t")
 
-        # I'll rename one column for a cleaner look
-        events.rename(columns={'trial_type': 'trial'}, inplace=True)
-
-        # We only want stimuli, so filter the dataset so that it only contains stimulus rows
-        events = events[events.trial.str.match(r'Stimulus/S...')]
-
-        # Fill in new columns according to information coded in stimulus ID:
-        # Take the last 3 symbols of event comments and transform them to event codes
-        events['trial'] = events['trial'].transform(lambda string: int(string[-3:]))
-        # Define event type using event code
-        events['event'] = events['trial'].transform(lambda stimulus: self.get_event_type(stimulus))
-        # Determine stimulus file using event code
-        events['stim_file'] = events['trial'].transform(lambda stimulus: self.get_stim_file(stimulus))
-        # Add object rotation if exists
-        events['rotation'] = events['trial'].transform(
-            lambda stimulus: 'n/a' if (stimulus > 156) else (stimulus % 20 - 1) * 22.5 + 11.25)
-        # Add object position if exists
-        events['position'] = events['trial'].transform(
-            lambda stimulus: (stimulus % 200 - 1) * 22.5 + 11.25 if (201 <= stimulus <= 216) else 'n/a')
-
-        # Every object position is marked as a separate event RIGHT AFTER the event encoding an object and its
-        # rotation. We use this to couple an object and its position, so that one row represents one real event.
-        # Then we clean the table from unnecessary position-only rows.
-        for index, event in events.iterrows():
-            if event['event'] == 'position':
-                events.at[index - 1, 'position'] = event['position']
-
-        events = events[events.event != 'position']
+        # We only want stimuli, so filter the dataset so that it only contains stimulus rows. The last 3 symbols of
+        # event comments are the event codes.
+        events = events[events.trial_type.str.match(r'Stimulus/S...')]
+        triggers = events.trial_type.str[-3:].astype(np.int16).to_numpy()
 
-        # Let's write the new dataframe to _events.tsv
-        events[['onset', 'duration', 'trial', 'sample', 'stim_file', 'event', 'rotation', 'position']].to_csv(
-            events_path, index=False, na_rep="n/a", sep="\t")
+        # Let's write the decoded events to _events.tsv
+        decoded = self.decode_events(events.onset.to_numpy(), events.duration.to_numpy(),
+                                     events['sample'].to_numpy(), triggers)
+        events_table(decoded).to_csv(events_path, index=False, na_rep="n/a", sep="\t")
 
         # Next, let's add a JSON sidecar with description of *_events.tsv data
 
-        json_path = BIDSPath(subject=self.id, task=self.task, root=bids_root, datatype='eeg', suffix='events',
-                             extension=".json")
+        json_path = BIDSPath(subject=self.id, task=self.task, run=run, root=bids_root, datatype='eeg',
+                             suffix='events', extension=".json")
         json_eeg_events = textfiles.eeg_events()
         textfiles.write(json_eeg_events, json_path)
 
-        # Last, let's update the auto-generated metadata with available information.
-        json_path = BIDSPath(subject=self.id, task=self.task, root=bids_root, datatype='eeg', suffix='eeg',
+    def stim_codes(self):
+        """
+        Stimulus files of all trigger IDs as categorical codes, for vectorized decoding of trigger arrays
+        :return np.ndarray: STIM_FILES.index(self.get_stim_file(trigger_id)) for every trigger ID from 0 to 255
+        """
+        return np.array([STIM_FILES.index(self.get_stim_file(trigger_id)) for trigger_id in range(256)],
+                        dtype=np.uint8)
+
+    def decode_events(self, onsets, durations, samples, triggers):
+        """
+        Decode stimulus markers into events: event type, stimulus file, object rotation and position
+        :param np.ndarray onsets: Onsets of the markers (seconds)
+        :param np.ndarray durations: Durations of the markers (seconds)
+        :param np.ndarray samples: Onsets of the markers (samples)
+        :param np.ndarray triggers: Trigger IDs of the markers
+        :return np.ndarray: Structured array of EVENT_DTYPE, one element per event. Missing rotations and positions
+        are NaN, event types and stimulus files are codes into EVENT_TYPES and STIM_FILES (see events_table())
+        """
+        triggers = np.asarray(triggers, dtype=np.int16)
+        types = EVENT_LUT[triggers]
+        events = np.empty(len(triggers), dtype=EVENT_DTYPE)
+        events['onset'] = onsets
+        events['duration'] = durations
+        events['trial'] = triggers
+        events['sample'] = samples
+        events['stim_file'] = self.stim_codes()[triggers]
+        events['event'] = types
+        # Rotations are coded in encoding and distractor IDs
+        events['rotation'] = np.where(triggers > 156, np.nan, (triggers % 20 - 1) * 22.5 + 11.25)
+
+        # Every object position is marked as a separate event RIGHT AFTER the event encoding an object and its
+        # rotation. We use this to couple an object and its position, so that one element represents one real event.
+        # Then we drop the position-only events.
+        is_position = types == EVENT_TYPES.index('position')
+        events['position'] = np.nan
+        events['position'][:-1][is_position[1:]] = (triggers[1:][is_position[1:]] % 200 - 1) * 22.5 + 11.25
+        return events[~is_position]
+
+    def events(self, bids_root=BIDS_ROOT, run=None):
+        """
+        Read converted events of the subject in the compact form of decode_events()
+        :param str bids_root: Location of the converted data
+        :param int run: Run number, see raw_to_bids(). None if the recording is not split into runs
+        :return np.ndarray: Structured array of EVENT_DTYPE
+        """
+        events_path = BIDSPath(subject=self.id, task=self.task, run=run, root=bids_root, datatype='eeg',
+                               suffix='events', extension=".tsv")
+        table = pd.read_csv(events_path, sep="\t", na_values="n/a", keep_default_na=False)
+        events = np.empty(len(table), dtype=EVENT_DTYPE)
+        for name in ['onset', 'duration', 'trial', 'sample', 'rotation', 'position']:
+            events[name] = table[name].to_numpy()
+        # Unknown or missing names are coded as n/a
+        for name, categories in [('stim_file', STIM_FILES), ('event', EVENT_TYPES)]:
+            codes = pd.Categorical(table[name], categories=categories).codes
+            events[name] = np.where(codes < 0, categories.index('n/a'), codes)
+        return events
+
+    def eeg_sidecar_to_bids(self, bids_root=BIDS_ROOT, run=None):
+        """
+        Update the auto-generated _eeg.json from MNE-BIDS with known recording metadata
+        :param str bids_root: Location of the converted data
+        :param int run: Run number, see raw_to_bids(). None if the recording is not split into runs
+        """
+        # Let's update the auto-generated metadata with available information.
+        json_path = BIDSPath(subject=self.id, task=self.task, run=run, root=bids_root, datatype='eeg', suffix='eeg',
                              extension=".json")
         with open(json_path, 'r+') as data:
-            eeg_json = json.load(data)
-            eeg_json["Instructions"] = "Instructions can be found..."
-            eeg_json["EEGReference"] = "FCz"
-            eeg_json["EEGGround"] = "Fpz"
-            eeg_json["InstitutionName"] = "Max Plack Institute for Human Development"
-            eeg_json["InstitutionAddress"] = "Lentzeallee 94, 14195 Berlin, Germany"
-            eeg_json["ManufacturersModelName"] = "BrainAmp DC and BrainAmp ExG"
-            eeg_json["SoftwareVersions"] = "BrainVision Recorder Professional V.1.24.0001"
-            eeg_json["CapManufacturer"] = "EasyCAP"
-            eeg_json["CapManufacturersModelName"] = "actiCAP 64 Ch Standard-2"
-            del eeg_json["EMGChannelCount"]
-            del eeg_json["MiscChannelCount"]
+            eeg_json = textfiles.eeg_sidecar(json.load(data))
             data.seek(0)
             json.dump(eeg_json, data, ensure_ascii=False, indent=4)
             data.truncate()
 
-    def beh_to_bids(self, bids_root=BIDS_ROOT):
+    def beh_to_bids(self, bids_root=BIDS_ROOT, run=None):
         """
         Copy behavioral data of a subject to a new BIDS-compatible location and drop redundant/empty columns
         :param bids_root: New location of the data
+        :param int run: Write only the data of this start of the experiment (see beh_segments()) as a run. None for
+        all data, trials repeated after a restart are kept only once then
         """
-        # First, copy the initial behavioral data file into a BIDS-compatible folder
-        bids_path = BIDSPath(subject=self.id, task=self.task, root=bids_root, datatype='beh', suffix="beh",
+        # Read the initial behavioral data, split at restarts of the experiment, and drop redundant and empty columns
+        bids_path = BIDSPath(subject=self.id, task=self.task, run=run, root=bids_root, datatype='beh', suffix="beh",
                              extension=".tsv").mkdir()
-        shutil.copy(self.beh_path, bids_path)
-
-        # Drop redundant and empty columns
-        beh_data = pd.read_csv(bids_path, sep='\t')
-
-        # It is not enough to just use any number of whitespaces as delimiter. One edge case supposes that the
-        # participant has neither changed the object, nor the orientation (e.g. the correct object has spawned in the
-        # correct orientation). This means some data will be filled with whitespaces, and this causes data shift for
-        # some trials when using delim_whitespace=True. So I'm stripping the whitespaces semi-manually.
-        beh_data = beh_data.applymap(lambda x: str(x).replace(" ", ""))
-        beh_data.columns = beh_data.columns.str.replace(" ", "")
-
-        # Drop duplicate header rows (needs to happen before checking for empty cells!)
-        beh_data = beh_data[beh_data.iloc[:, 0] != beh_data.columns[0]]
-
-        # Drop first duplicate trials if restarted the experiment
-        beh_data.drop_duplicates(subset=['trial'], keep='last', inplace=True)
+        segments = self.beh_segments()
+        if run is None:
+            beh_data = pd.concat(segments)
+            # Drop first duplicate trials if restarted the experiment
+            beh_data.drop_duplicates(subset=['trial'], keep='last', inplace=True)
+        else:
+            beh_data = segments[run - 1].copy()
 
         # Columns to drop
         empty_cols = [col for col in beh_data.columns if
@@ -278,7 +470,7 @@ class Subject:
         beh_data.to_csv(bids_path, sep='\t', index=False)
 
         # Create an accompanying JSON sidecar with data description
-        json_path = BIDSPath(subject=self.id, task=self.task, root=bids_root, datatype="beh", suffix="beh",
+        json_path = BIDSPath(subject=self.id, task=self.task, run=run, root=bids_root, datatype="beh", suffix="beh",
                              extension=".json")
         json_data = textfiles.behavioral(self.task)
         textfiles.write(json_data, json_path)
@@ -286,13 +478,40 @@ class Subject:
     def data(self):
         """
         Constructs and returns a dictionary which can be used as a data row in participants.tsv
-        :return pd.DataFrame: Participant dataframe with a single row of information
-        """
-        participant_dict = pd.DataFrame([{'participant_id': f'sub-{self.id}',
-                                          'age': self.age,
-                                          'hand': self.hand,
-                                          'sex': self.sex,
-                                          'stimuli_set': self.stimuli,
-                                          'distractor': {True: 1, False: 0}[bool(self.distractors)],
-                                          'distractor_set': self.distractors}])
-        return participant_dict
+        :return dict: Participant information, one entry per column
+        """
+        return {'participant_id': f'sub-{self.id}',
+                'age': self.age,
+                'hand': self.hand,
+                'sex': self.sex,
+                'stimuli_set': self.stimuli,
+                'distractor': int(bool(self.distractors)),
+                'distractor_set': self.distractors}
+
+
+# Event types as categorical codes for vectorized decoding of trigger arrays:
+# EVENT_TYPES[EVENT_LUT[trigger_id]] == Subject.get_event_type(trigger_id) for every trigger ID from 0 to 255
+EVENT_TYPES = ['encoding', 'distractor', 'position', 'retrocue', 'left', 'right', 'down', 'up', 'feedback',
+               'begin/end', 'n/a']
+EVENT_LUT = np.array([EVENT_TYPES.index(Subject.get_event_type(trigger_id)) for trigger_id in range(256)],
+                     dtype=np.uint8)
+# Stimulus files as categorical codes, see Subject.stim_codes()
+STIM_FILES = [stim_file for stim_set in Subject._STIM_MAT for stim_file in stim_set] + \
+             ['One_F3_350.wav', 'Two_F3_350.wav', 'test.wav', 'n/a']
+# Decoded events as structured arrays, see Subject.decode_events(). Fields are the columns of *_events.tsv: trial is
+# the trigger ID, stim_file and event are codes into STIM_FILES and EVENT_TYPES, NaN stands for n/a.
+EVENT_DTYPE = np.dtype([('onset', np.float64), ('duration', np.float64), ('trial', np.int16), ('sample', np.int64),
+                        ('stim_file', np.uint8), ('event', np.uint8), ('rotation', np.float32),
+                        ('position', np.float32)])
+
+
+def events_table(events):
+    """
+    Turn decoded events into a table, e.g. to write them into *_events.tsv (with na_rep="n/a")
+    :param np.ndarray events: Structured array of EVENT_DTYPE, see Subject.decode_events()
+    :return pd.DataFrame: One row per event, with names of event types and stimulus files
+    """
+    table = pd.DataFrame(events)
+    table['stim_file'] = np.array(STIM_FILES, dtype=object)[events['stim_file']]
+    table['event'] = np.array(EVENT_TYPES, dtype=object)[events['event']]
+    return table
@@ -21,7 +21,9 @@ TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR TH
 SOFTWARE.
 """
 
+import os
 import json
+import threading
 
 
 def eeg_events():
@@ -114,6 +116,73 @@ def eeg_events():
     return contents
 
 
+def trial_events(items):
+    """
+    Generates a JSON sidecar describing trial tables (*_desc-trials_events.tsv, see trials.py)
+    :param int items: Number of encoding items per trial
+    :return: JSON sidecar with description of the columns
+    """
+    markers = eeg_events()
+    contents = {
+        "Description": "One row per trial, assembled from the EEG markers of the recording. A trial ends with its "
+                       "feedback marker; incomplete trials are left out.",
+        "onset": {
+            "Description": "Onset of the first encoding item of the trial",
+            "Units": "Seconds"
+        },
+        "duration": {
+            "Description": "Time from the first encoding item to the feedback",
+            "Units": "Seconds"
+        },
+        "run": {
+            "Description": "Start of the experiment the trial belongs to, counted from 1 where the experiment has been "
+                           "restarted (trial numbers of the behavioral data start anew), n/a otherwise. Together with "
+                           "trial, it identifies the row of the behavioral data (beh/*_beh.tsv) belonging to the trial."
+        },
+        "trial": {
+            "Description": "Trial number taken from the trial column of the behavioral data. n/a if the number of "
+                           "trials in the EEG markers and the behavioral data of a start of the experiment differs."
+        },
+        "sample": {
+            "Description": "Onset of the trial according to the sampling scheme of the recorded modality."
+        },
+    }
+    for item in range(1, items + 1):
+        contents.update({
+            f"encoding_{item}_onset": {"Description": f"Onset of encoding item {item}", "Units": "Seconds"},
+            f"encoding_{item}_object": {"Description": f"Filename of encoding item {item}"},
+            f"encoding_{item}_rotation": dict(markers["rotation"], Description=f"Rotation of encoding item {item}, "
+                                                                               f"with reference to vertical axis"),
+            f"encoding_{item}_position": dict(markers["position"], Description=f"Offset position of encoding item "
+                                                                               f"{item}"),
+        })
+    contents.update({
+        "n_encoding": {"Description": "Number of encoding items in the trial"},
+        "distractor_onset": {"Description": "Onset of the distractor item", "Units": "Seconds"},
+        "distractor_object": {"Description": "Filename of the distractor item"},
+        "distractor_rotation": dict(markers["rotation"], Description="Rotation of the distractor item, with "
+                                                                     "reference to vertical axis"),
+        "distractor_position": dict(markers["position"], Description="Offset position of the distractor item"),
+        "cue": {
+            "Description": "TTL trigger value of the retrocue",
+            "Levels": {level: markers["trial"]["Levels"][level] for level in ["221", "222"]}
+        },
+        "cue_file": {"Description": "Filename of the retrocue sound"},
+        "cue_onset": {"Description": "Onset of the retrocue", "Units": "Seconds"},
+    })
+    for key in ["left", "right", "down", "up"]:
+        contents[f"n_{key}"] = {"Description": f"Number of presses of the {key} arrow key. "
+                                               f"{markers['event']['Levels'][key]}"}
+    contents.update({
+        "response_onset": {"Description": "Onset of the first key press", "Units": "Seconds"},
+        "response_latency": {"Description": "Time from the retrocue to the first key press", "Units": "Seconds"},
+        "response_offset": {"Description": "Onset of the last key press", "Units": "Seconds"},
+        "feedback_onset": {"Description": "Onset of the feedback screen", "Units": "Seconds"},
+        "feedback_latency": {"Description": "Time from the last key press to the feedback", "Units": "Seconds"},
+    })
+    return contents
+
+
 def behavioral(task):
     """
     Generates a _beh.json file with description of behavioral events' dataset
@@ -328,6 +397,30 @@ def behavioral(task):
     return contents
 
 
+def eeg_sidecar(contents):
+    """
+    Updates an _eeg.json file generated by MNE-BIDS with known recording metadata
+    :param contents: JSON sidecar as generated by MNE-BIDS (or as updated before)
+    :return: Updated JSON sidecar
+    """
+    contents = dict(contents)
+    contents.update({
+        "Instructions": "Instructions can be found...",
+        "EEGReference": "FCz",
+        "EEGGround": "Fpz",
+        "InstitutionName": "Max Planck Institute for Human Development",
+        "InstitutionAddress": "Lentzeallee 94, 14195 Berlin, Germany",
+        "ManufacturersModelName": "BrainAmp DC and BrainAmp ExG",
+        "SoftwareVersions": "BrainVision Recorder Professional V.1.24.0001",
+        "CapManufacturer": "EasyCAP",
+        "CapManufacturersModelName": "actiCAP 64 Ch Standard-2",
+    })
+    # There are no EMG and miscellaneous channels in the recordings
+    contents.pop("EMGChannelCount", None)
+    contents.pop("MiscChannelCount", None)
+    return contents
+
+
 def participants():
     """
     Generates a participants.json file with description of participants.tsv file.
@@ -406,6 +499,29 @@ def dataset_description():
     return contents
 
 
+def derivative_description(name, description):
+    """
+    Generates a dataset_description JSON for derivatives of the dataset
+    :param name: Name of the derivatives dataset
+    :param description: What the derivatives contain and how they have been computed
+    :return: JSON sidecar with dataset description
+    """
+    contents = dataset_description()
+    contents.update({
+        "Name": name,
+        "DatasetType": "derivative",
+        "GeneratedBy": [{
+            "Name": "memoreeg2bids derivatives.py",
+            "Description": description
+        }],
+        "DatasetLinks": {
+            "raw": "../../"
+        }
+    })
+    del contents["DatasetDOI"]
+    return contents
+
+
 def bidsignore():
     """
     Generates contents of .bidsignore file
@@ -582,6 +698,19 @@ def write(text, path):
     :param path: Path of the file to write into (filename and extension included).
     :return: None
     """
-    with open(path, 'w', encoding="utf-8") as output:
-        json.dump(text, output, ensure_ascii=False, indent=4)
-        output.write("\n")
+    # The file is written under a temporary name and renamed, so that readers (e.g. MNE-BIDS while sidecars are
+    # deduplicated, see inheritance.py) see either the old or the new file, never half of it
+    path = os.fspath(path)
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, 'w', encoding="utf-8") as output:
+        output.write(dumps(text))
+    os.replace(temporary, path)
+
+
+def dumps(text):
+    """
+    Serialize a JSON structure exactly the way write() puts it into a file.
+    :param text: JSON structure to serialize.
+    :return str: File contents
+    """
+    return json.dumps(text, ensure_ascii=False, indent=4) + "\n"
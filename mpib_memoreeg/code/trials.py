@@ -0,0 +1,121 @@
+"""
+Following code assembles the EEG markers of every subject into trials, one row per trial with onsets, encoding items,
+distractor, retrocue, key presses and feedback:
+BIDS_ROOT/derivatives/trials/sub-XX/eeg/sub-XX_task-<task>_desc-trials_events.tsv
+
+Markers are split into trials as defined in markers.py, the recordings themselves are not loaded. Trials get the run
+and trial numbers of the behavioral data, which starts anew with every restart of the experiment, so that both can be
+joined on run and trial. Trials of a part of the experiment are only numbered if there are as many of them as in the
+behavioral data, mismatches are reported. Run from the BIDS_ROOT/code folder:
+
+python trials.py [--subjects 1,2,10-15]
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os
+import os.path as op
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import textfiles
+import subject as s
+import markers as m
+import derivatives as d
+import source2bids
+from mne_bids import BIDSPath
+
+# Default BIDS path.
+BIDS_ROOT = op.join(op.dirname(op.realpath(__file__)), "..")
+
+
+def trials_path(participant, bids_root=BIDS_ROOT, extension=".tsv"):
+    """
+    Helper function to determine location of the trial table of a subject
+    :param s.Subject participant: Subject the trials belong to
+    :param str bids_root: Location of the raw dataset
+    :param str extension: .tsv for the table, .json for the sidecar
+    :return str: Path of the file
+    """
+    path = BIDSPath(subject=participant.id, task=participant.task, root=d.derivatives_root(d.TRIALS, bids_root),
+                    datatype="eeg", suffix="events", description="trials", extension=extension, check=False)
+    return str(path.fpath)
+
+
+def subject_trials(participant, bids_root=BIDS_ROOT):
+    """
+    Assemble the trials of a single subject and write them into BIDS_ROOT/derivatives/trials
+    :param s.Subject participant: Subject to process
+    :param str bids_root: Location of the dataset
+    :return tuple: (trial table, list of problems with numbering trials, see markers.number_trials()). The table is
+    None if the EEG data is missing (e.g. sub-20)
+    """
+    try:
+        header = participant.header()
+        samples, codes, types = participant.triggers()
+        starts = [start for start, _ in participant.eeg_segments()]
+    except FileNotFoundError:
+        return None, []
+    stim_files = np.array(s.STIM_FILES, dtype=object)[participant.stim_codes()]
+    table, problems = m.number_trials(m.split_trials(samples, codes, types, header['sfreq'], stim_files, starts),
+                                      m.behavioral_trials(participant))
+
+    tsv_path = trials_path(participant, bids_root)
+    os.makedirs(op.dirname(tsv_path), exist_ok=True)
+    table.to_csv(tsv_path, index=False, na_rep='n/a', sep='\t')
+    textfiles.write(textfiles.trial_events(m.ITEMS), trials_path(participant, bids_root, ".json"))
+
+    table.insert(0, 'participant_id', f'sub-{participant.id}')
+    return table, problems
+
+
+def run(participants, bids_root=BIDS_ROOT, jobs=os.cpu_count()):
+    """
+    Assemble trials of all subjects in parallel
+    :param list participants: Subject class instances to process
+    :param str bids_root: Location of the dataset
+    :param int jobs: Number of parallel processes
+    :return tuple: (trial tables of all subjects with a participant_id column, problems with numbering trials mapped
+    to participant IDs)
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(subject_trials, participants, [bids_root] * len(participants)))
+    d.make_description(d.TRIALS, bids_root)
+    tables = [table for table, _ in results if table is not None]
+    problems = {f'sub-{participant.id}': found for participant, (_, found) in zip(participants, results) if found}
+    return (pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()), problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Assemble EEG markers of MemorEEG subjects into trials.')
+    parser.add_argument('--subjects', type=source2bids.parse_subjects,
+                        help='Process only the given subjects, e.g. 1,2,10-15.')
+    args = parser.parse_args()
+    participants = source2bids.read_participants(source2bids.select_subjects(args.subjects))
+    table, problems = run(participants, source2bids.BIDS_ROOT)
+    if len(table):
+        print(table.groupby('participant_id').size().rename('trials').to_string())
+    for participant_id, found in problems.items():
+        for problem in found:
+            print(f'{participant_id}: {problem}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+Following code keeps the dataset up to date during data collection: it watches the sourcedata folder and converts
+every subject as soon as its source files (behavioral/resultfile_p0XX.txt and, unless the EEG data has not been
+recorded, eeg/p0XX.vhdr, .vmrk and .eeg) are complete and no longer being written. participants.tsv is then updated
+from participants_log.tsv. Subjects already published by a conversion of the whole dataset are not converted again
+unless their source files change.
+
+Changes are noticed through file system notifications if the watchdog package is installed, otherwise (and
+additionally, e.g. on network file systems without notifications) the folder is scanned regularly. Run from the
+BIDS_ROOT/code folder:
+
+python watch.py [--once]
+
+This code is licensed under MIT (https://opensource.org/licenses/MIT)
+
+Copyright 2022 Juan Linde-Domingo, Aleksandra Zinoveva
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or substantial portions of the
+Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Import necessary packages
+import os
+import os.path as op
+import re
+import glob
+import json
+import time
+import argparse
+import threading
+from datetime import datetime
+import textfiles
+import pipeline as p
+import staging
+import inheritance
+import source2bids
+
+# watchdog is optional, without it changes are only noticed by scanning
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# Default source data root
+DATA_PATH = source2bids.DATA_PATH
+# How often is the sourcedata folder scanned (seconds)? With notifications, changes are noticed earlier.
+POLL_SECONDS = 60
+# How long must source files of a subject stay unchanged before they are converted (seconds)?
+STABLE_SECONDS = 120
+# Signatures of source files of converted subjects, to notice changes after a restart
+STATE = op.join(source2bids.BIDS_ROOT, staging.STAGING, "watch.json")
+
+# Source files of a subject: {id} is the three-digit participant number from participants_log.tsv, e.g. 001. EEG
+# files are either all there or all missing (e.g. sub-20, whose EEG data has not been recorded).
+EEG_FILES = ["eeg/p{id}.vhdr", "eeg/p{id}.vmrk", "eeg/p{id}.eeg"]
+BEH_FILES = ["behavioral/resultfile_p{id}.txt"]
+SOURCE_FILES = EEG_FILES + BEH_FILES
+ID_PATTERN = re.compile(r"(?:p|resultfile_p)(\d{3})\.(?:vhdr|vmrk|eeg|txt)$")
+
+
+class _Wake(FileSystemEventHandler):
+    """
+    Class wakes up the scanning loop whenever something changes in the watched folder
+    """
+
+    def __init__(self, event):
+        super().__init__()
+        self.event = event
+
+    def on_any_event(self, event):
+        self.event.set()
+
+
+def signature(sub_id, data_path=DATA_PATH):
+    """
+    Helper function to describe the current state of source files of a subject
+    :param int sub_id: Numerical subject ID
+    :param str data_path: Root folder with source data
+    :return list: [size, mtime_ns] of every source file (see SOURCE_FILES), None for missing EEG files. None if the
+    source files are incomplete: the behavioral file or some, but not all EEG files are missing
+    """
+    state = []
+    for pattern in SOURCE_FILES:
+        path = op.join(data_path, pattern.format(id=f"{sub_id:03}"))
+        if op.exists(path):
+            stat = os.stat(path)
+            state.append([stat.st_size, stat.st_mtime_ns])
+        else:
+            state.append(None)
+    eeg = state[:len(EEG_FILES)]
+    if None in state[len(EEG_FILES):] or (None in eeg and any(eeg)):
+        return None
+    return state
+
+
+def source_subjects(data_path=DATA_PATH):
+    """
+    Find subject IDs which have at least one source file
+    :param str data_path: Root folder with source data
+    :return set: Numerical subject IDs
+    """
+    sub_ids = set()
+    for folder in ["eeg", "behavioral"]:
+        if op.isdir(op.join(data_path, folder)):
+            for name in os.listdir(op.join(data_path, folder)):
+                match = ID_PATTERN.match(name)
+                if match:
+                    sub_ids.add(int(match.group(1)))
+    # Only subjects of the study: sub-49 not collected (see README/Missing data)
+    return sub_ids & (set(source2bids.SUBJECTS) - {49})
+
+
+class Watcher:
+    """
+    Class keeps track of source files of all subjects and decides which of them are ready to be converted.
+    """
+
+    def __init__(self, data_path=DATA_PATH, state_path=STATE, stable_seconds=STABLE_SECONDS, published=None):
+        """
+        Construct Watcher class instance
+        :param str data_path: Root folder with source data
+        :param str state_path: Location of the file with signatures of converted subjects
+        :param float stable_seconds: How long source files must stay unchanged before conversion
+        :param dict published: Subject folder names (format: sub-XX) mapped to the time they have been published (ISO
+        format, see staging.Journal), e.g. by a conversion of the whole dataset. A published subject not converted by
+        the watcher yet counts as converted if its source files have not changed since.
+        """
+        self.data_path = data_path
+        self.state_path = state_path
+        self.stable_seconds = stable_seconds
+        # Subject ID -> (signature, time since when it has not changed)
+        self.seen = {}
+        # Subject ID -> signature at the time of conversion
+        self.converted = {}
+        if op.exists(state_path):
+            with open(state_path, "r", encoding="utf-8") as state:
+                self.converted = {int(sub_id): value for sub_id, value in json.load(state).items()}
+        for sub, when in (published or {}).items():
+            sub_id = int(sub[len("sub-"):])
+            current = signature(sub_id, data_path)
+            if sub_id in self.converted or current is None:
+                continue
+            changed = max(mtime for _, mtime in filter(None, current)) / 1e9
+            if changed <= datetime.fromisoformat(when).timestamp():
+                self.converted[sub_id] = current
+
+    def ready(self, now=None):
+        """
+        Scan source files and find subjects whose files are complete, stable and not converted in this state yet
+        :param float now: Current time (seconds), default time.monotonic()
+        :return list: Numerical subject IDs
+        """
+        now = time.monotonic() if now is None else now
+        ready = []
+        for sub_id in sorted(source_subjects(self.data_path)):
+            current = signature(sub_id, self.data_path)
+            if current is None:
+                continue
+            previous, since = self.seen.get(sub_id, (None, now))
+            if current != previous:
+                since = now
+            self.seen[sub_id] = (current, since)
+            if now - since >= self.stable_seconds and self.converted.get(sub_id) != current:
+                ready.append(sub_id)
+        return ready
+
+    def done(self, sub_ids):
+        """
+        Remember subjects as converted with their current source files
+        :param list sub_ids: Numerical subject IDs
+        """
+        for sub_id in sub_ids:
+            self.converted[sub_id] = self.seen[sub_id][0]
+        os.makedirs(op.dirname(self.state_path), exist_ok=True)
+        textfiles.write({str(sub_id): value for sub_id, value in sorted(self.converted.items())}, self.state_path)
+
+
+def convert(sub_ids, journal):
+    """
+    Convert chosen subjects and update participants.tsv (and shared sidecars) of the dataset
+    :param list sub_ids: Numerical subject IDs
+    :param staging.Journal journal: Journal of published subjects
+    """
+    # participants_log.tsv is read again, it grows during data collection as well
+    participants = source2bids.read_participants(sub_ids)
+    for participant in participants:
+        # Source files changed since the last conversion, so it has to be done again
+        journal.forget(f"sub-{participant.id}")
+
+    pipeline = p.Pipeline()
+    source2bids.add_subject_tasks(pipeline, participants, journal)
+    fragments = [task.outputs[0] for task in pipeline.tasks if task.name.endswith(':participant')]
+    pipeline.add('participants', source2bids.make_participants, inputs=fragments, outputs=['participants.tsv'])
+    if source2bids.INHERIT_SIDECARS:
+        subs = [task.outputs[0] for task in pipeline.tasks if task.name.endswith(':publish')]
+        pipeline.add('inheritance', inheritance.deduplicate_all, source2bids.BIDS_ROOT, inputs=subs, outputs=subs)
+    pipeline.run(cpu_jobs=source2bids.CPU_JOBS, io_jobs=source2bids.IO_JOBS, memory_budget=source2bids.MEMORY_BUDGET)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert MemorEEG subjects as their source data arrives.')
+    parser.add_argument('--once', action='store_true',
+                        help='Scan once, convert subjects whose files are complete and stop.')
+    args = parser.parse_args()
+
+    # Subjects published by other runs (e.g. the conversion of the whole dataset) are known from their journals
+    journal = staging.Journal(op.join(source2bids.BIDS_ROOT, staging.STAGING, "journal-watch.tsv"),
+                              glob.glob(op.join(source2bids.BIDS_ROOT, staging.STAGING, "journal*.tsv")))
+    # Finish publishing interrupted by a previous stop
+    staging.recover(source2bids.BIDS_ROOT, [f"sub-{sub_id:02}" for sub_id in source2bids.SUBJECTS])
+    watcher = Watcher(stable_seconds=0 if args.once else STABLE_SECONDS, published=journal.published)
+
+    wake = threading.Event()
+    observer = None
+    if Observer is not None:
+        observer = Observer()
+        observer.schedule(_Wake(wake), DATA_PATH, recursive=True)
+        observer.start()
+    else:
+        print(f'watchdog is not installed, scanning {DATA_PATH} every {POLL_SECONDS} s')
+
+    try:
+        while True:
+            ready = watcher.ready()
+            if ready:
+                print(f'Converting {", ".join(f"sub-{sub_id:02}" for sub_id in ready)}')
+                try:
+                    convert(ready, journal)
+                    watcher.done(ready)
+                except (IndexError, RuntimeError) as error:
+                    # E.g. participants_log.tsv has no row for a new subject yet. Try again with the next change.
+                    print(f'Conversion failed, retrying later: {error!r}')
+            if args.once:
+                break
+            # Source files are still being written: check again when they should be stable
+            waiting = [sub_id for sub_id, (current, _) in watcher.seen.items()
+                       if watcher.converted.get(sub_id) != current]
+            wake.wait(min(POLL_SECONDS, STABLE_SECONDS) if waiting else POLL_SECONDS)
+            wake.clear()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+
+
+if __name__ == '__main__':
+    main()